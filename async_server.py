@@ -0,0 +1,247 @@
+import asyncio
+from collections import deque
+
+from codec import encode_frame
+from server import FRAME_TOO_LARGE, HOST, PORT, TOO_MANY_CONNECTIONS, Server
+
+WRITE_BUFFER_LIMIT = 64 * 1024  # Bytes handed to a transport before frames wait in the bounded queue
+
+class DeliveryStats:
+    """The asyncio engine's counterpart of DeliveryScheduler's counters"""
+
+    def __init__(self, queue_size=1024, overflow="drop_oldest"):
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+class AsyncNotificationConnection:
+    def __init__(self, host, port, loop, on_failure=None, stats=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.loop = loop
+        self.on_failure = on_failure  # Called with this connection when the listener cannot be reached
+        self.stats = stats or DeliveryStats()  # Shared by every connection of the server, bounds pending
+        self.timeout = timeout
+        self.writer = None
+        self.pending = deque()  # Frames waiting for the connection or for the transport to drain
+        self.flushing = False  # A flush task owns pending
+        self.closed = False
+        self.client_id = None  # Set by the server that registered this listener
+        self.codec = None
+
+    def send(self, data):
+        """Write a frame without blocking; past WRITE_BUFFER_LIMIT it waits in a queue bounded like
+        the delivery scheduler's, overflowing by the same policy"""
+        if self.closed:
+            return False
+        if not self.flushing and self.writable():
+            self.writer.write(data)
+            self.stats.delivered += 1
+            return True
+        stats = self.stats
+        if len(self.pending) >= stats.queue_size:
+            if stats.overflow == "drop_newest":
+                stats.dropped += 1
+                return True
+            if stats.overflow == "drop_oldest":
+                self.pending.popleft()
+                stats.dropped += 1
+            else:
+                stats.dropped += len(self.pending) + 1
+                stats.disconnected += 1
+                self.pending.clear()
+                self.close()
+                return True
+        self.pending.append(data)
+        if not self.flushing:
+            self.flushing = True
+            self.loop.create_task(self.flush())
+        return True
+
+    def writable(self):
+        return (self.writer is not None and not self.writer.is_closing()
+                and self.writer.transport.get_write_buffer_size() < WRITE_BUFFER_LIMIT)
+
+    async def flush(self):
+        """Open the connection if needed, then feed pending frames as the transport drains"""
+        try:
+            if self.writer is None or self.writer.is_closing():
+                self.writer = None
+                _, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                writer.transport.set_write_buffer_limits(WRITE_BUFFER_LIMIT)
+                if self.closed:
+                    writer.close()
+                    return
+                self.writer = writer
+            while self.pending and not self.closed:
+                while self.pending and self.writable():
+                    self.writer.write(self.pending.popleft())
+                    self.stats.delivered += 1
+                if self.pending:
+                    await self.writer.drain()
+        except (OSError, asyncio.TimeoutError):
+            self.stats.failed += len(self.pending)
+            self.pending.clear()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            if self.on_failure is not None and not self.closed:
+                self.on_failure(self)
+        finally:
+            self.flushing = False
+
+    def close(self):
+        self.closed = True
+        if self.writer is not None:
+            # abort, not close: a listener that stopped reading would keep a closing transport open forever
+            self.writer.transport.abort()
+            self.writer = None
+
+class IdleReaper:
+    """Closes connections that missed their read deadline; one timer checks them all"""
+
+    def __init__(self, interval=1.0, on_timeout=None):
+        self.interval = interval
+        self.on_timeout = on_timeout
+        self.deadlines = {}  # writer -> loop time by which its pending read must finish
+        self.loop = None
+
+    def start(self, loop):
+        self.loop = loop
+        loop.call_later(self.interval, self.reap)
+
+    def expect(self, writer, timeout):
+        if timeout is None:
+            self.deadlines.pop(writer, None)
+        else:
+            self.deadlines[writer] = self.loop.time() + timeout
+
+    def forget(self, writer):
+        self.deadlines.pop(writer, None)
+
+    def reap(self):
+        now = self.loop.time()
+        expired = [writer for writer, deadline in self.deadlines.items() if deadline < now]
+        for writer in expired:
+            # The pending readexactly then fails like any other disconnect
+            del self.deadlines[writer]
+            writer.close()
+            if self.on_timeout is not None:
+                self.on_timeout()
+        self.loop.call_later(self.interval, self.reap)
+
+class AsyncServer(Server):
+    """Single-threaded event-loop engine speaking the same protocol as Server"""
+
+    def __init__(self, host=HOST, port=PORT, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.loop = None
+        # Notifications are written from the loop, the scheduler only lends its queue bounds
+        self.delivery = DeliveryStats(self.scheduler.queue_size, self.scheduler.overflow)
+        # Per-read timeouts without a wait_for task around every readexactly
+        self.reaper = IdleReaper(on_timeout=lambda: self.metrics.inc("timed_out_connections_total"))
+
+    def open_notification_connection(self, host, port):
+        return AsyncNotificationConnection(host, port, self.loop, self.forget_notification_connection,
+                                           self.delivery)
+
+    def delivery_stats(self):
+        stats = self.delivery
+        with self.lock:
+            depths = [len(connection.pending) for connection in self.notification_connections.values()
+                      if connection.pending]
+        return {
+            "workers": 0,
+            "queue_size": stats.queue_size,
+            "overflow": stats.overflow,
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "backlogged_subscribers": len(depths),
+            "delivered": stats.delivered,
+            "failed": stats.failed,
+            "dropped": stats.dropped,
+            "disconnected": stats.disconnected
+        }
+
+    def enqueue_notification(self, notify, *args):
+        # Handlers run on the loop thread, so defer fan-out until the handler released its locks
+        def notify_async():
+            try:
+                notify(*args)
+            except Exception:
+                self.metrics.inc("notify_errors_total")
+        self.loop.call_soon_threadsafe(notify_async)
+
+    def call_later(self, delay, callback, *args):
+        # Coalescing flushes run on the loop like everything else, no timer thread needed
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback, *args)
+
+    def deliver(self, recipients, frame):
+        # Writers never block and bound their own queues, so there is nothing to hand off to a worker pool
+        for connection in recipients:
+            try:
+                self.send_notification(connection, frame)
+            except Exception:
+                self.metrics.inc("failed_sends_total")
+
+    async def handle_connection(self, reader, writer):
+        client_addr = writer.get_extra_info("peername")[:2]
+        client_id = f"{client_addr[0]}:{client_addr[1]}"
+        if not self.peers.acquire(client_addr[0]):
+            self.metrics.inc("rejected_connections_total")
+            writer.write(encode_frame(TOO_MANY_CONNECTIONS, self.codecs["json"]))
+            writer.close()
+            return
+        self.metrics.inc("connections_opened_total")
+        try:
+            while True:
+                try:
+                    self.reaper.expect(writer, self.idle_timeout)
+                    length_bytes = await reader.readexactly(4)
+                    length = int.from_bytes(length_bytes, 'big')
+                    if length > self.max_frame_bytes:
+                        self.metrics.inc("oversized_frames_total")
+                        writer.write(encode_frame(FRAME_TOO_LARGE, self.codecs["json"]))
+                        break
+                    # Once a frame has started the rest of it, and the response, get read_timeout
+                    self.reaper.expect(writer, self.read_timeout)
+                    data = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                codec = self.client_codecs.get(client_id, self.codecs["json"])
+                response = self.handle_request(data, client_id, client_addr)
+                if self.storage is not None:
+                    commit = self.storage.take_pending()
+                    if commit:
+                        # fsync happens on the flusher thread; only this connection waits for it
+                        if not await self.loop.run_in_executor(None, self.storage.wait, commit):
+                            response = self.not_persisted(response)
+                        self.reaper.expect(writer, self.read_timeout)
+                writer.write(encode_frame(response, codec))
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.reaper.forget(writer)
+            self.drop_client(client_id)
+            writer.close()
+            self.peers.release(client_addr[0])
+            self.metrics.inc("connections_closed_total")
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        if self.storage is not None:
+            self.storage.start(self.snapshot)
+        self.start_metrics_listener()
+        self.reaper.start(self.loop)
+        self.start_heartbeats()
+        server = await asyncio.start_server(self.handle_connection, sock=self.sock, backlog=self.backlog)
+        print(f"Server running on {self.host}:{self.port} (TCP, asyncio)")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
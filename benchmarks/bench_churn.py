@@ -0,0 +1,75 @@
+"""Client churn: broadcast latency after many clients registered a listener and went away.
+
+Connects --rounds batches of --clients clients that announce a notification
+listener and then disconnect, then times how long a new_channel broadcast
+takes to reach a client that is still connected, and how many listeners
+the server still holds.
+
+    python benchmarks/bench_churn.py --rounds 5 --clients 100
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client
+from client import Client
+
+def churn(count):
+    clients = [Client(on_notification=lambda notification, addr: None) for _ in range(count)]
+    for c in clients:
+        c.setup_notification_listener()
+        c.announce_notification_port()
+    for c in clients:
+        c.notification_sock.close()
+        c.sock.shutdown(socket.SHUT_RDWR)
+        c.sock.close()
+
+def broadcast_seconds(observer, notifications, name):
+    start = time.perf_counter()
+    observer.send_request({"type": "create_channel", "channel_name": name, "description": "bench",
+                           "notification_port": observer.notification_port})
+    while True:
+        notification = notifications.get(timeout=30)
+        if notification["type"] == "new_channel" and notification["channel"]["name"] == name:
+            return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=3530)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=100, help="Clients connecting and leaving per round")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    args = parser.parse_args()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--port", str(args.port),
+                               "--engine", args.engine], stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        client.SERVER_PORT = args.port
+        notifications = queue.Queue()
+        observer = Client(on_notification=notifications)
+        observer.setup_notification_listener()
+        observer.announce_notification_port()
+        threading.Thread(target=observer.receive_notifications, daemon=True).start()
+        for i in range(args.rounds + 1):
+            if i:
+                churn(args.clients)
+                time.sleep(0.5)
+            seconds = broadcast_seconds(observer, notifications, f"churn-{i}")
+            gauges = observer.send_request({"type": "stats"})["stats"]["gauges"]
+            print(json.dumps({"departed_clients": i * args.clients, "broadcast_ms": round(seconds * 1000, 2),
+                              "notification_connections": gauges["notification_connections"]}), flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Encode/decode cost and bytes on the wire: JSON vs the binary codec, per message type.
+
+    python benchmarks/bench_codec.py --iterations 2000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import decode, make_codecs
+
+NEWS = {"seq": 1042, "content": "Breaking: markets close higher as tech stocks rally", "author": "127.0.0.1:50412",
+        "timestamp": "2026-10-17 09:30:00"}
+CHANNEL = {"name": "Tech", "description": "Technology and innovation", "creator": "127.0.0.1:50412",
+           "subscriber_count": 1250}
+
+SAMPLES = {
+    "notification_hello": {"type": "notification_hello", "notification_port": 50413, "codec": "binary",
+                           "request_id": 1},
+    "list_channels": {"type": "list_channels", "request_id": 2},
+    "create_channel": {"type": "create_channel", "channel_name": "Tech", "description": "Technology and innovation",
+                       "notification_port": 50413, "request_id": 3},
+    "subscribe": {"type": "subscribe", "channel_name": "Tech", "request_id": 4},
+    "publish_news": {"type": "publish_news", "channel_name": "Tech", "content": NEWS["content"], "request_id": 5},
+    "get_news": {"type": "get_news", "channel_name": "Tech", "cursor": 1000, "limit": 50, "request_id": 6},
+    "response:status": {"status": "success", "message": "News published successfully", "request_id": 5},
+    "response:list_channels(200)": {"status": "success", "channels": [dict(CHANNEL, name=f"Channel {i}")
+                                                                       for i in range(200)], "request_id": 2},
+    "response:get_news(50)": {"status": "success", "news": [dict(NEWS, seq=1000 + i) for i in range(50)],
+                              "next_cursor": 1050, "has_more": True, "request_id": 6},
+    "notification:new_news": {"type": "new_news", "channel_name": "Tech", "news": NEWS,
+                              "message": "New news in channel 'Tech'"},
+    "notification:new_channel": {"type": "new_channel", "channel": CHANNEL, "message": "New channel 'Tech' created"},
+}
+
+def measure(func, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--compress-threshold", type=int, default=1024)
+    args = parser.parse_args()
+    codecs = make_codecs(args.compress_threshold)
+    for name, message in SAMPLES.items():
+        result = {"message": name}
+        for codec in codecs.values():
+            body = codec.encode(message)
+            assert decode(body) == message
+            result[codec.name] = {
+                "bytes": len(body) + 4,
+                "encode_us": round(measure(codec.encode, message, args.iterations), 2),
+                "decode_us": round(measure(decode, body, args.iterations), 2)
+            }
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""How many concurrent clients can one server process hold?
+
+Starts server.py in a subprocess with the chosen engine, opens client
+connections in steps, performs a list_channels round trip on each and
+reports the server's RSS and thread count as the connection count grows.
+
+    python benchmarks/bench_connections.py --engine asyncio --clients 5000
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def proc_status(pid):
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value.strip()
+    return int(status["VmRSS"].split()[0]) // 1024, int(status["Threads"])
+
+def round_trip(sock, request):
+    message = json.dumps(request).encode()
+    sock.sendall(len(message).to_bytes(4, 'big') + message)
+    length = sock.recv(4, socket.MSG_WAITALL)
+    return json.loads(sock.recv(int.from_bytes(length, 'big'), socket.MSG_WAITALL))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="asyncio")
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--step", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=3400)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--engine", args.engine, "--port", str(args.port)],
+        stdout=subprocess.DEVNULL, preexec_fn=lambda: resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)))
+    time.sleep(0.5)
+    sockets = []
+    results = []
+    try:
+        start = time.perf_counter()
+        while len(sockets) < args.clients:
+            try:
+                sock = socket.create_connection(("127.0.0.1", args.port), timeout=10)
+                round_trip(sock, {"type": "list_channels"})
+            except OSError as e:
+                print(f"stopped at {len(sockets)} clients: {e}")
+                break
+            sockets.append(sock)
+            if len(sockets) % args.step == 0:
+                rss, threads = proc_status(server.pid)
+                results.append({"clients": len(sockets), "rss_mb": rss, "threads": threads,
+                                "elapsed_s": round(time.perf_counter() - start, 3)})
+                print(f"{len(sockets):>7} clients  rss={rss:>5} MB  threads={threads:>6}")
+        # Every held connection must still be served
+        for sock in sockets:
+            round_trip(sock, {"type": "list_channels"})
+        print(json.dumps({"engine": args.engine, "held": len(sockets), "steps": results}))
+    finally:
+        for sock in sockets:
+            sock.close()
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Forbidden-word filtering: the original per-word substring loop vs ContentFilter.
+
+    python benchmarks/bench_filter.py --messages 2000
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_filter import ContentFilter
+
+def substring_loop(words, content):
+    content_lower = content.lower()
+    for word in words:
+        if word in content_lower:
+            return False
+    return True
+
+def random_text(rng, words):
+    return " ".join("".join(rng.choices(string.ascii_letters, k=rng.randint(2, 9))) for _ in range(words))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--message-words", type=int, default=40)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    messages = [random_text(rng, args.message_words) for _ in range(args.messages)]
+    for terms in (10, 1000, 10000):
+        words = list({"".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12))) for _ in range(terms)})
+        matcher = ContentFilter(words)
+        start = time.perf_counter()
+        expected = [substring_loop(words, message) for message in messages]
+        loop_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = [matcher.allows(message) for message in messages]
+        matcher_seconds = time.perf_counter() - start
+        assert expected == actual
+        print(json.dumps({
+            "terms": terms,
+            "loop_us_per_message": round(loop_seconds / args.messages * 1e6, 1),
+            "content_filter_us_per_message": round(matcher_seconds / args.messages * 1e6, 1)
+        }))
+
+if __name__ == "__main__":
+    main()
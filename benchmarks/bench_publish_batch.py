@@ -0,0 +1,93 @@
+"""Feed import: pipelined publish_news vs publish_batch vs a coalescing window.
+
+Starts a server, subscribes --subscribers clients to one channel per mode,
+publishes --headlines items and reports how long it took until every
+subscriber had every headline, and how many frames each subscriber received.
+
+    python benchmarks/bench_publish_batch.py --headlines 5000 --subscribers 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client
+from client import Client
+
+class Counter:
+    def __init__(self):
+        self.frames = 0
+        self.items = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, notification, addr):
+        if notification["type"] not in ("new_news", "news_batch"):
+            return
+        with self.lock:
+            self.frames += 1
+            self.items += len(notification["news"]) if notification["type"] == "news_batch" else 1
+
+def run(mode, args, publisher, subscribers):
+    channel = f"bench-{mode}"
+    publisher.send_request({"type": "create_channel", "channel_name": channel, "description": "bench",
+                            "notification_port": publisher.notification_port,
+                            "coalesce_ms": args.coalesce_ms if mode == "coalesced" else 0})
+    counters = []
+    for subscriber in subscribers:
+        subscriber.on_notification = counter = Counter()
+        counters.append(counter)
+        subscriber.send_request({"type": "subscribe", "channel_name": channel})
+    headlines = [f"headline {i} from the feed importer" for i in range(args.headlines)]
+    start = time.perf_counter()
+    if mode == "publish_batch":
+        requests = [{"type": "publish_batch", "channel_name": channel, "contents": headlines[i:i + args.batch]}
+                    for i in range(0, len(headlines), args.batch)]
+    else:
+        requests = [{"type": "publish_news", "channel_name": channel, "content": headline} for headline in headlines]
+    for i in range(0, len(requests), 500):
+        for future in publisher.send_requests_async(requests[i:i + 500]):
+            future.result()
+    acknowledged = time.perf_counter() - start
+    deadline = time.monotonic() + 60
+    while any(counter.items < args.headlines for counter in counters) and time.monotonic() < deadline:
+        time.sleep(0.005)
+    delivered = time.perf_counter() - start
+    publisher.send_request({"type": "delete_channel", "channel_name": channel})
+    return {"mode": mode, "headlines": args.headlines, "subscribers": len(subscribers),
+            "acknowledged_s": round(acknowledged, 3), "delivered_s": round(delivered, 3),
+            "frames_per_subscriber": round(sum(counter.frames for counter in counters) / len(counters), 1),
+            "items_per_subscriber": round(sum(counter.items for counter in counters) / len(counters), 1)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=3520)
+    parser.add_argument("--headlines", type=int, default=5000)
+    parser.add_argument("--subscribers", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=100, help="Items per publish_batch request")
+    parser.add_argument("--coalesce-ms", type=int, default=20)
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    args = parser.parse_args()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--port", str(args.port),
+                               "--engine", args.engine], stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        client.SERVER_PORT = args.port
+        clients = [Client(on_notification=lambda notification, addr: None) for _ in range(args.subscribers + 1)]
+        for c in clients:
+            c.setup_notification_listener()
+            c.announce_notification_port()
+            threading.Thread(target=c.receive_notifications, daemon=True).start()
+        for mode in ("publish_news", "publish_batch", "coalesced"):
+            print(json.dumps(run(mode, args, clients[0], clients[1:])), flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
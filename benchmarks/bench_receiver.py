@@ -0,0 +1,102 @@
+"""Notification receive rate: the original thread-per-connection reader vs Client's selector receiver.
+
+A sender thread writes --count new_news frames over each of --connections
+TCP connections as fast as it can; the receiver decodes every frame and
+hands it to a counting callback.
+
+    python benchmarks/bench_receiver.py --count 50000 --connections 4
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client import Client
+from codec import decode, encode_frame, make_codecs
+
+def receive_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        packet = sock.recv(n - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
+
+def thread_per_connection(listener, connections, on_notification):
+    def handle(conn, addr):
+        while True:
+            length_bytes = receive_exact(conn, 4)
+            if not length_bytes:
+                return
+            body = receive_exact(conn, int.from_bytes(length_bytes, 'big'))
+            if not body:
+                return
+            on_notification(decode(body), addr)
+    for _ in range(connections):
+        conn, addr = listener.accept()
+        threading.Thread(target=handle, args=(conn, addr), daemon=True).start()
+
+def send_frames(port, frame, count):
+    sock = socket.create_connection(("127.0.0.1", port))
+    batch = frame * 100
+    for _ in range(count // 100):
+        sock.sendall(batch)
+    sock.close()
+
+def run(receiver, args, frame):
+    received = 0
+    done = threading.Event()
+    total = args.count // 100 * 100 * args.connections
+
+    def on_notification(notification, addr):
+        nonlocal received
+        received += 1
+        if received == total:
+            done.set()
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(args.connections)
+    port = listener.getsockname()[1]
+    if receiver == "selector":
+        client = Client(on_notification=on_notification)
+        client.notification_sock = listener
+        threading.Thread(target=client.receive_notifications, daemon=True).start()
+    else:
+        threading.Thread(target=thread_per_connection, args=(listener, args.connections, on_notification),
+                         daemon=True).start()
+    start = time.perf_counter()
+    senders = [threading.Thread(target=send_frames, args=(port, frame, args.count)) for _ in range(args.connections)]
+    for sender in senders:
+        sender.start()
+    done.wait(120)
+    seconds = time.perf_counter() - start
+    listener.close()
+    return {"receiver": receiver, "connections": args.connections, "frame_bytes": len(frame),
+            "received": received, "notifications_per_s": round(received / seconds)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=50000, help="Frames per connection")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--content-bytes", type=int, default=200)
+    args = parser.parse_args()
+    notification = {
+        "type": "new_news",
+        "channel_name": "bench",
+        "news": {"seq": 1, "content": "x" * args.content_bytes, "author": "127.0.0.1:5000",
+                 "timestamp": "2024-01-01 00:00:00"},
+        "message": "New news in channel 'bench'"
+    }
+    frame = encode_frame(notification, make_codecs()["json"])
+    for receiver in ("thread_per_connection", "selector"):
+        print(json.dumps(run(receiver, args, frame)))
+
+if __name__ == "__main__":
+    main()
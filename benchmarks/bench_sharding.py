@@ -0,0 +1,149 @@
+"""Publish and fan-out throughput as the number of shard processes grows.
+
+For each shard count, starts `server.py --shards N` (N=1 is the plain
+single-process server), connects subscriber processes that follow every
+channel and publisher processes that pipeline publish_news requests, then
+reports acknowledged publishes and delivered notifications per second.
+
+    python benchmarks/bench_sharding.py --max-shards 4 --duration 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client
+
+def count_frames(listener, counter, stop):
+    """Accept notification connections and count frames without decoding them"""
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    buffers = {}
+    while not stop.is_set():
+        for key, _ in selector.select(timeout=0.2):
+            if key.fileobj is listener:
+                conn, _ = listener.accept()
+                conn.setblocking(False)
+                buffers[conn] = b""
+                selector.register(conn, selectors.EVENT_READ)
+                continue
+            conn = key.fileobj
+            data = conn.recv(65536)
+            if not data:
+                selector.unregister(conn)
+                conn.close()
+                del buffers[conn]
+                continue
+            buffer = buffers[conn] + data
+            frames = 0
+            while len(buffer) >= 4 and len(buffer) >= 4 + int.from_bytes(buffer[:4], 'big'):
+                buffer = buffer[4 + int.from_bytes(buffer[:4], 'big'):]
+                frames += 1
+            buffers[conn] = buffer
+            with counter.get_lock():
+                counter.value += frames
+
+def subscriber(port, clients, channels, counter, ready, stop):
+    client.SERVER_PORT = port
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+    subscribers = []
+    for _ in range(clients):
+        sub = client.Client()
+        sub.notification_port = listener.getsockname()[1]
+        sub.send_request({"type": "notification_hello", "notification_port": sub.notification_port})
+        for future in sub.send_requests_async([{"type": "subscribe", "channel_name": name} for name in channels]):
+            future.result()
+        subscribers.append(sub)
+    ready.release()
+    count_frames(listener, counter, stop)
+
+def publisher(port, channels, batch, counter, ready, start, stop):
+    client.SERVER_PORT = port
+    pub = client.Client()
+    for name in channels:
+        pub.send_request({"type": "create_channel", "channel_name": name, "description": "bench",
+                          "notification_port": 0})
+    ready.release()
+    start.wait()
+    i = 0
+    while not stop.is_set():
+        requests = [{"type": "publish_news", "channel_name": channels[(i + j) % len(channels)],
+                     "content": f"headline {i + j} sent at {time.time()}"} for j in range(batch)]
+        i += batch
+        published = sum(future.result()["status"] == "success" for future in pub.send_requests_async(requests))
+        with counter.get_lock():
+            counter.value += published
+
+def run(shards, args):
+    port = args.port
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port),
+                               "--shards", str(shards), "--shard-base-port", str(port + 1)],
+                              stdout=subprocess.DEVNULL)
+    time.sleep(1 + 0.3 * shards)
+    names = [f"bench-{i}" for i in range(args.channels)]
+    published = multiprocessing.Value("q", 0)
+    delivered = multiprocessing.Value("q", 0)
+    ready = multiprocessing.Semaphore(0)
+    start = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    publishers = [multiprocessing.Process(target=publisher, args=(
+        port, names[i::args.publishers], args.batch, published, ready, start, stop)) for i in range(args.publishers)]
+    for process in publishers:
+        process.start()
+    for _ in publishers:
+        ready.acquire()
+    subscribers = [multiprocessing.Process(target=subscriber, args=(
+        port, args.subscribers_per_process, names, delivered, ready, stop)) for _ in range(args.subscriber_processes)]
+    for process in subscribers:
+        process.start()
+    for _ in subscribers:
+        ready.acquire()
+    start.set()
+    time.sleep(args.warmup)
+    published_before, delivered_before = published.value, delivered.value
+    time.sleep(args.duration)
+    result = {
+        "shards": shards,
+        "cpu_count": os.cpu_count(),
+        "publishes_per_s": round((published.value - published_before) / args.duration),
+        "notifications_per_s": round((delivered.value - delivered_before) / args.duration),
+        "subscribers": args.subscriber_processes * args.subscribers_per_process,
+        "channels": args.channels
+    }
+    stop.set()
+    for process in publishers + subscribers:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+    server.terminate()
+    server.wait()
+    time.sleep(0.5)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-shards", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=3500)
+    parser.add_argument("--channels", type=int, default=64)
+    parser.add_argument("--publishers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=50, help="Pipelined publishes per round trip")
+    parser.add_argument("--subscriber-processes", type=int, default=2)
+    parser.add_argument("--subscribers-per-process", type=int, default=25)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+    for shards in range(1, args.max_shards + 1):
+        print(json.dumps(run(shards, args)), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Publish throughput with the write-ahead log off, on without fsync, and on with fsync.
+
+Drives Server.handle_publish_news directly from several threads, each waiting
+for its own commit like handle_client does, so group commit can batch the
+fsyncs of concurrent publishers.
+
+    python benchmarks/bench_storage.py --publishers 8 --messages 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import Server
+from storage import Storage
+
+def run(mode, publishers, messages):
+    directory = tempfile.mkdtemp(prefix="news-wal-")
+    storage = None if mode == "memory" else Storage(directory, fsync=(mode == "wal+fsync"))
+    server = Server(port=0, storage=storage)
+    if storage is not None:
+        storage.start(server.snapshot)
+    server.handle_create_channel("bench", "benchmark channel", "publisher")
+
+    def publish():
+        for i in range(messages):
+            server.handle_publish_news("bench", f"headline {i}", "publisher")
+            server.wait_durable()
+
+    threads = [threading.Thread(target=publish) for _ in range(publishers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if storage is not None:
+        storage.close()
+    server.sock.close()
+    shutil.rmtree(directory)
+    total = publishers * messages
+    return {"mode": mode, "publishes": total, "seconds": round(elapsed, 3), "per_second": round(total / elapsed)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--publishers", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=2000, help="Publishes per publisher thread")
+    args = parser.parse_args()
+    for mode in ("memory", "wal", "wal+fsync"):
+        result = run(mode, args.publishers, args.messages)
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,146 @@
-import socket
+import argparse
 import json
+import secrets
+import selectors
+import socket
 import threading
 import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from itertools import count
+
+from codec import decode, encode_frame, make_codecs
 
 HOST = "127.0.0.1"
 SERVER_PORT = 3333
+NO_RESPONSE = {"status": "error", "message": "No response from server"}
+HEARTBEAT_INTERVAL = 30  # Most seconds without a request before pinging; lowered to a third of the server's idle timeout
+
+class FrameReader:
+    """Receive buffer for one connection, filled with recv_into and drained frame by frame"""
+
+    def __init__(self, size=65536):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not yet consumed
+        self.end = 0  # One past the last byte received
+
+    def make_room(self, needed):
+        if self.start:
+            # Move the partial frame to the front
+            pending = self.end - self.start
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        if needed > len(self.buffer):
+            # A bytearray with a live memoryview cannot be resized, so swap in a larger one
+            buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            buffer[:self.end] = self.view[:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+
+    def read_from(self, sock):
+        """Receive what is available; returns the complete frame bodies, or None at end of stream"""
+        if self.end == len(self.buffer):
+            self.make_room(self.end - self.start + 1)
+        received = sock.recv_into(self.view[self.end:])
+        if not received:
+            return None
+        self.end += received
+        frames = []
+        while self.end - self.start >= 4:
+            length = int.from_bytes(self.view[self.start:self.start + 4], 'big')
+            frame_end = self.start + 4 + length
+            if frame_end > self.end:
+                if 4 + length > len(self.buffer):
+                    self.make_room(4 + length)
+                break
+            frames.append(bytes(self.view[self.start + 4:frame_end]))
+            self.start = frame_end
+        if self.start == self.end:
+            self.start = self.end = 0
+        return frames
+
+class Heartbeat:
+    """One thread for every Client in the process, pinging the server over connections left idle and
+    bringing back sessions the server dropped"""
 
-class Client:
     def __init__(self):
+        self.clients = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, client):
+        with self.lock:
+            self.clients.add(client)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="heartbeat", daemon=True)
+                self.thread.start()
+
+    def reschedule(self):
+        """Called when a client's interval shrinks, so the current sleep does not outlast it"""
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            with self.lock:
+                tick = min((client.heartbeat_interval for client in self.clients), default=HEARTBEAT_INTERVAL) / 3
+            self.wakeup.wait(tick)
+            self.wakeup.clear()
+            with self.lock:
+                clients = list(self.clients)
+            now = time.monotonic()
+            for client in clients:
+                idle = client.sock is not None and now - client.last_sent >= client.heartbeat_interval
+                if idle or (client.session_lost and client.listening()):
+                    try:
+                        # Reconnecting for a lost session also restores it
+                        client.send_request_async({"type": "heartbeat"})
+                    except OSError:
+                        pass  # Server unreachable, try again next tick
+
+HEARTBEAT = Heartbeat()
+
+class Client:
+    def __init__(self, codec="json", on_notification=None, token=None):
         self.sock = None
+        # Identifies us as the owner of the channels we create, across reconnects and server restarts
+        self.token = token or secrets.token_urlsafe(16)
         self.notification_sock = None
         self.notification_port = None
         self.receive_thread = None
         self.channels = []
-        self.connection_lock = threading.Lock()
+        self.directory = {}  # channel name -> entry, kept in sync by list_channels
+        self.directory_version = None
+        self.connection_lock = threading.Lock()  # Serializes writes to the server connection
+        self.pending_lock = threading.Lock()  # Never held while blocked on the socket
+        self.pending = OrderedDict()  # request_id -> Future, in send order
+        self.request_ids = count(1)
+        self.last_sent = time.monotonic()  # Read by the heartbeat thread
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.session_lost = False  # The server closed our connection and dropped its listener and subscriptions
+        self.subscribed = set()  # Channels and patterns to subscribe again when a lost session is restored
+        self.interactive = False
+        self.codecs = make_codecs()
+        self.preferred_codec = codec
+        self.codec = self.codecs["json"]  # Until the server accepts preferred_codec
+        # Receives each notification and the address it came from; defaults to printing it.
+        # A queue can be passed instead, it is then given just the notifications.
+        if hasattr(on_notification, "put"):
+            queue = on_notification
+            on_notification = lambda notification, addr: queue.put(notification)
+        self.on_notification = on_notification or self.process_notification
 
     def connect_to_server(self):
         if self.sock:
             self.sock.close()
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((HOST, SERVER_PORT))
+            self.sock = None
+        # Only a connected socket is kept, so after a refused connect the next request tries again
+        sock = socket.create_connection((HOST, SERVER_PORT))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        threading.Thread(target=self.receive_responses, args=(self.sock,), daemon=True).start()
+        HEARTBEAT.add(self)
 
     def setup_notification_listener(self):
         self.notification_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -28,39 +149,128 @@ class Client:
         self.notification_sock.listen(5)
 
     def send_request(self, request):
+        return self.send_request_async(request).result()
+
+    def send_request_async(self, request):
+        return self.send_requests_async([request])[0]
+
+    def send_requests_async(self, requests):
+        """Pipeline requests in one write; returns a Future per request, resolved with its response"""
+        futures = []
+        frames = []
+        restore = []
         with self.connection_lock:
             if not self.sock:
                 self.connect_to_server()
-            message = json.dumps(request).encode()
-            self.sock.sendall(len(message).to_bytes(4, 'big'))
-            self.sock.sendall(message)
-            length_bytes = self.receive_exact(4)
-            if not length_bytes:
-                return {"status": "error", "message": "No response from server"}
-            resp_len = int.from_bytes(length_bytes, 'big')
-            resp_bytes = self.receive_exact(resp_len)
-            if not resp_bytes:
-                return {"status": "error", "message": "No response from server"}
-            return json.loads(resp_bytes.decode())
-
-    def receive_exact(self, n):
-        data = b''
-        while len(data) < n:
-            packet = self.sock.recv(n - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
+                if self.session_lost:
+                    # Ahead of the caller's requests, so they run against the restored session
+                    restore = self.session_requests()
+                    self.session_lost = False
+            for request in restore + list(requests):
+                request_id = next(self.request_ids)
+                future = Future()
+                with self.pending_lock:
+                    self.pending[request_id] = future
+                futures.append(future)
+                frames.append(encode_frame(dict(request, request_id=request_id), self.codec))
+            try:
+                self.sock.sendall(b"".join(frames))
+                self.last_sent = time.monotonic()
+            except OSError:
+                with self.pending_lock:
+                    self.fail_pending()
+        if restore:
+            self.track_restore(restore, futures[:len(restore)])
+        return futures[len(restore):]
+
+    def resubscribed(self, name, response):
+        # Refused, e.g. the channel was deleted while we were away. Without a response the session is
+        # lost again, and the next restore retries
+        if response["status"] != "success" and response != NO_RESPONSE:
+            self.subscribed.discard(name)
+
+    def listening(self):
+        return self.notification_port is not None and self.notification_sock.fileno() != -1
+
+    def session_requests(self):
+        if not self.listening():
+            return []
+        return [self.hello_request()] + [{"type": "subscribe", "channel_name": name} for name in sorted(self.subscribed)]
+
+    def track_restore(self, requests, futures):
+        futures[0].add_done_callback(lambda future: self.accept_hello(future.result()))
+        for request, future in zip(requests[1:], futures[1:]):
+            future.add_done_callback(lambda future, name=request["channel_name"]: self.resubscribed(name, future.result()))
+        if self.interactive:
+            print("\n🔌 Reconnected to the server, subscriptions restored")
+
+    def receive_responses(self, sock):
+        try:
+            while True:
+                length_bytes = self.receive_exact_from_socket(sock, 4)
+                if not length_bytes:
+                    break
+                resp_bytes = self.receive_exact_from_socket(sock, int.from_bytes(length_bytes, 'big'))
+                if not resp_bytes:
+                    break
+                response = decode(resp_bytes)
+                with self.pending_lock:
+                    # Responses come back in request order; the id also covers servers that reorder
+                    if response.get("request_id") in self.pending:
+                        future = self.pending.pop(response.pop("request_id"))
+                    elif self.pending:
+                        future = self.pending.popitem(last=False)[1]
+                    else:
+                        continue
+                future.set_result(response)
+        except (OSError, ValueError):
+            pass
+        with self.connection_lock:
+            if self.sock is sock:
+                # No reader is left for this connection, so no request may wait on it: the next one reconnects
+                self.sock = None
+                self.session_lost = True
+                sock.close()
+                with self.pending_lock:
+                    self.fail_pending()
+
+    def fail_pending(self):
+        while self.pending:
+            _, future = self.pending.popitem(last=False)
+            future.set_result(dict(NO_RESPONSE))
 
     def list_channels(self):
-        response = self.send_request({"type": "list_channels"})
+        request = {"type": "list_channels"}
+        if self.directory_version is not None:
+            # Only download what changed since the last listing
+            request["since_version"] = self.directory_version
+        response = self.send_request(request)
         if response["status"] == "success":
-            self.channels = response["channels"]
+            if response.get("full", True):
+                self.directory = {channel["name"]: channel for channel in response["channels"]}
+            else:
+                for channel in response["channels"]:
+                    self.directory[channel["name"]] = channel
+                for name in response["deleted"]:
+                    self.directory.pop(name, None)
+            self.directory_version = response.get("version")
+            self.channels = [self.directory[name] for name in sorted(self.directory)]
             print("\nAvailable channels:")
             self.display_channels()
         else:
             print(f"Failed to get channels: {response['message']}")
 
+    def find_channels(self, text, cursor=None, limit=20):
+        response = self.send_request({"type": "list_channels", "search": text, "cursor": cursor, "limit": limit})
+        if response["status"] == "success":
+            self.channels = response["channels"]
+            print(f"\nChannels matching '{text}':")
+            self.display_channels()
+            if response["has_more"]:
+                print(f"  More channels available: find_channels \"{text}\" \"{response['next_cursor']}\"")
+        else:
+            print(f"Failed to find channels: {response['message']}")
+
     def display_channels(self):
         if not self.channels:
             print("  No channels available")
@@ -84,12 +294,25 @@ class Client:
 
     def subscribe(self, channel_name):
         response = self.send_request({"type": "subscribe", "channel_name": channel_name})
+        if response["status"] == "success":
+            self.subscribed.add(channel_name)
         print(response["message"])
 
     def unsubscribe(self, channel_name):
         response = self.send_request({"type": "unsubscribe", "channel_name": channel_name})
+        if response["status"] == "success":
+            self.subscribed.discard(channel_name)
         print(response["message"])
 
+    def subscribe_many(self, channel_names):
+        futures = self.send_requests_async([{"type": "subscribe", "channel_name": name} for name in channel_names])
+        responses = [future.result() for future in futures]
+        for name, response in zip(channel_names, responses):
+            if response["status"] == "success":
+                self.subscribed.add(name)
+            print(response["message"])
+        return responses
+
     def publish_news(self, channel_name, content):
         response = self.send_request({"type": "publish_news", "channel_name": channel_name, "content": content})
         if response["status"] == "success":
@@ -97,92 +320,189 @@ class Client:
         else:
             print(f"Failed to publish news: {response['message']}")
 
+    def publish_many(self, channel_name, contents):
+        futures = self.send_requests_async([
+            {"type": "publish_news", "channel_name": channel_name, "content": content} for content in contents
+        ])
+        responses = [future.result() for future in futures]
+        published = sum(1 for response in responses if response["status"] == "success")
+        print(f"Published {published}/{len(responses)} news")
+        for response in responses:
+            if response["status"] != "success":
+                print(f"Failed to publish news: {response['message']}")
+        return responses
+
+    def publish_batch(self, channel_name, contents):
+        response = self.send_request({"type": "publish_batch", "channel_name": channel_name, "contents": contents})
+        if response["status"] == "success":
+            print(response["message"])
+        else:
+            print(f"Failed to publish news: {response['message']}")
+        for i in response.get("blocked", []):
+            print(f"  Blocked: {contents[i]}")
+        return response
+
     def get_subscriptions(self):
         response = self.send_request({"type": "get_subscriptions"})
         if response["status"] == "success":
             subscriptions = response["subscriptions"]
+            patterns = response.get("patterns", [])
             print("\nYour subscriptions:")
-            if not subscriptions:
+            if not subscriptions and not patterns:
                 print("  No subscriptions")
             else:
                 for i, channel in enumerate(subscriptions):
                     print(f"  {i+1}. {channel['name']} - {channel['description']}")
+                for pattern in patterns:
+                    print(f"  * {pattern} (pattern)")
         else:
             print(f"Failed to get subscriptions: {response['message']}")
 
+    def get_news(self, channel_name, cursor=0, limit=20):
+        response = self.send_request({"type": "get_news", "channel_name": channel_name, "cursor": cursor, "limit": limit})
+        if response["status"] == "success":
+            print(f"\nNews in channel '{channel_name}':")
+            if not response["news"]:
+                print("  No news")
+            for news in response["news"]:
+                print(f"  [{news['timestamp']}] {news['author']}: {news['content']}")
+            if response["has_more"]:
+                print(f"  More news available: get_news \"{channel_name}\" {response['next_cursor']}")
+        else:
+            print(f"Failed to get news: {response['message']}")
+
+    def stats(self):
+        response = self.send_request({"type": "stats"})
+        if response["status"] == "success":
+            print(json.dumps(response["stats"], indent=2))
+        else:
+            print(f"Failed to get stats: {response['message']}")
+
     def receive_notifications(self):
-        print(f"🔔 Notification listener started on port {self.notification_port}")
-        while True:
-            try:
-                client_socket, addr = self.notification_sock.accept()
-                threading.Thread(target=self.handle_notification, args=(client_socket, addr), daemon=True).start()
-            except OSError as e:
-            # Socket closed intentionally on exit
-                break    
-            except Exception as e:
-                print(f"\n❌ Error accepting notification connection: {str(e)}")
-                continue
+        """Serve every notification connection from this one thread, decoding all the frames
+        that arrived with each wakeup"""
+        selector = selectors.DefaultSelector()
+        listener = self.notification_sock
+        listener.setblocking(False)
+        selector.register(listener, selectors.EVENT_READ)
+        while listener.fileno() != -1:
+            for key, _ in selector.select(timeout=1.0):
+                if key.fileobj is listener:
+                    try:
+                        conn, addr = listener.accept()
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        # Socket closed intentionally on exit
+                        return
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ, (FrameReader(), addr))
+                    continue
+                reader, addr = key.data
+                try:
+                    frames = reader.read_from(key.fileobj)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    frames = None
+                if frames is None:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    # The server dropped this stream, e.g. evicting us as a slow consumer or forgetting
+                    # the listener; announcing it again brings notifications back
+                    self.reannounce()
+                    continue
+                for body in frames:
+                    try:
+                        notification = decode(body)
+                        # Heartbeats only let the server notice a listener that went away
+                        if notification.get("type") == "heartbeat":
+                            continue
+                        self.on_notification(notification, addr)
+                    except Exception as e:
+                        print(f"\n❌ Error handling notification: {str(e)}")
+        selector.close()
 
-    def handle_notification(self, client_socket, addr):
-        try:
-            length_bytes = self.receive_exact_from_socket(client_socket, 4)
-            if not length_bytes:
-                return
-            notif_len = int.from_bytes(length_bytes, 'big')
-            notif_bytes = self.receive_exact_from_socket(client_socket, notif_len)
-            if not notif_bytes:
-                return
-            notification = json.loads(notif_bytes.decode())
-            print(f"\n📨 NOTIFICATION RECEIVED from {addr}: {notification.get('type', 'unknown')}")
-            if not isinstance(notification, dict) or 'type' not in notification:
-                return
-            if notification["type"] == "new_channel":
-                print(f"\n🆕 {notification['message']}")
-                channel = notification["channel"]
-                print(f"   {channel['name']} - {channel['description']}")
-                print(f"   Created by: {channel['creator']}")
-            elif notification["type"] == "channel_deleted":
-                print(f"\n🗑️ {notification['message']}")
-            elif notification["type"] == "new_news":
-                news = notification["news"]
-                print(f"\n📰 New news in channel '{notification['channel_name']}':")
+    def process_notification(self, notification, addr):
+        print(f"\n📨 NOTIFICATION RECEIVED from {addr}: {notification.get('type', 'unknown')}")
+        if not isinstance(notification, dict) or 'type' not in notification:
+            return
+        if notification["type"] == "new_channel":
+            print(f"\n🆕 {notification['message']}")
+            channel = notification["channel"]
+            print(f"   {channel['name']} - {channel['description']}")
+            print(f"   Created by: {channel['creator']}")
+            if notification.get("followed"):
+                print("   You follow this channel through a pattern subscription")
+        elif notification["type"] == "channel_deleted":
+            print(f"\n🗑️ {notification['message']}")
+        elif notification["type"] == "new_news":
+            news = notification["news"]
+            print(f"\n📰 New news in channel '{notification['channel_name']}':")
+            print(f"   [{news['timestamp']}] {news['author']}: {news['content']}")
+        elif notification["type"] == "news_batch":
+            print(f"\n📰 {len(notification['news'])} new news in channel '{notification['channel_name']}':")
+            for news in notification["news"]:
                 print(f"   [{news['timestamp']}] {news['author']}: {news['content']}")
-            print("> ", end="", flush=True)
-        except Exception as e:
-            print(f"\n❌ Error handling notification: {str(e)}")
-        finally:
-            client_socket.close()
+        print("> ", end="", flush=True)
 
     def receive_exact_from_socket(self, sock, n):
-        data = b''
-        while len(data) < n:
-            packet = sock.recv(n - len(data))
-            if not packet:
+        data = bytearray(n)
+        view = memoryview(data)
+        received = 0
+        while received < n:
+            count = sock.recv_into(view[received:])
+            if not count:
                 return None
-            data += packet
+            received += count
         return data
 
+    def hello_request(self):
+        return {"type": "notification_hello", "notification_port": self.notification_port,
+                "codec": self.preferred_codec, "token": self.token}
+
     def announce_notification_port(self):
-        self.send_request({
-            "type": "notification_hello",
-            "notification_port": self.notification_port
-        })
+        self.accept_hello(self.send_request(self.hello_request()))
+
+    def accept_hello(self, response):
+        # The server decodes either codec, so switching right away cannot garble a request in flight
+        self.codec = self.codecs.get(response.get("codec"), self.codecs["json"])
+        idle_timeout = response.get("idle_timeout")
+        self.heartbeat_interval = min(HEARTBEAT_INTERVAL, idle_timeout / 3) if idle_timeout else HEARTBEAT_INTERVAL
+        HEARTBEAT.reschedule()
+
+    def reannounce(self):
+        if not self.listening():
+            return
+        try:
+            self.send_request_async(self.hello_request()).add_done_callback(
+                lambda future: self.accept_hello(future.result()))
+        except OSError:
+            pass  # Server unreachable; the heartbeat thread restores the session once it is back
 
     def start(self):
         print("Welcome to the News Channel System! (TCP)")
         print("Commands:")
         print("  list_channels - Show all available channels")
+        print("  find_channels \"<text>\" [cursor] - Show channels whose name contains text")
         print("  create_channel \"<channel name>\" \"<description>\"")
         print("  delete_channel \"<channel name>\"")
-        print("  subscribe \"<channel name>\"")
+        print("  subscribe \"<channel name>\" - Also accepts patterns: \"sports/*\" (one level), \"markets/#\" (any depth)")
+        print("  subscribe_many \"<channel name>\" \"<channel name>\" ...")
         print("  unsubscribe \"<channel name>\"")
         print("  publish_news \"<channel name>\" <news content>")
+        print("  publish_many \"<channel name>\" \"<news content>\" \"<news content>\" ...")
+        print("  publish_batch \"<channel name>\" \"<news content>\" \"<news content>\" ... - Publish in one request")
         print("  my_subscriptions - Show your subscriptions")
+        print("  get_news \"<channel name>\" [cursor] - Show channel news history")
+        print("  stats - Show server metrics")
         print("  exit")
+        self.interactive = True
         self.setup_notification_listener()
         self.announce_notification_port()
         self.receive_thread = threading.Thread(target=self.receive_notifications, daemon=True)
         self.receive_thread.start()
+        print(f"🔔 Notification listener started on port {self.notification_port}")
         print("✅ Notification system ready!")
         while True:
             try:
@@ -209,20 +529,32 @@ class Client:
                 args = parts[1:]
                 if cmd == "list_channels" and len(args) == 0:
                     self.list_channels()
+                elif cmd == "find_channels" and len(args) in (1, 2):
+                    self.find_channels(args[0], args[1] if len(args) == 2 else None)
                 elif cmd == "create_channel" and len(args) == 2:
                     self.create_channel(args[0], args[1])
                 elif cmd == "delete_channel" and len(args) == 1:
                     self.delete_channel(args[0])
                 elif cmd == "subscribe" and len(args) == 1:
                     self.subscribe(args[0])
+                elif cmd == "subscribe_many" and len(args) >= 1:
+                    self.subscribe_many(args)
                 elif cmd == "unsubscribe" and len(args) == 1:
                     self.unsubscribe(args[0])
                 elif cmd == "publish_news" and len(args) >= 2:
                     channel_name = args[0]
                     content = " ".join(args[1:])
                     self.publish_news(channel_name, content)
+                elif cmd == "publish_many" and len(args) >= 2:
+                    self.publish_many(args[0], args[1:])
+                elif cmd == "publish_batch" and len(args) >= 2:
+                    self.publish_batch(args[0], args[1:])
                 elif cmd == "my_subscriptions" and len(args) == 0:
                     self.get_subscriptions()
+                elif cmd == "get_news" and len(args) in (1, 2):
+                    self.get_news(args[0], int(args[1]) if len(args) == 2 else 0)
+                elif cmd == "stats" and len(args) == 0:
+                    self.stats()
                 else:
                     print("Invalid command or arguments")
                     print("Use 'exit' to quit")
@@ -236,5 +568,13 @@ class Client:
             self.notification_sock.close()
 
 if __name__ == "__main__":
-    client = Client()
-    client.start() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="News channel client")
+    parser.add_argument("--codec", choices=["json", "binary"], default="json", help="Wire format to negotiate. binary frames are much smaller, large ones "
+                             "being compressed, for somewhat more CPU than json")
+    parser.add_argument("--token", default=None,
+                        help="Secret identifying you as the owner of your channels; reuse it to manage them after "
+                             "restarting the client (default: a new one each run)")
+    args = parser.parse_args()
+    client = Client(args.codec, token=args.token)
+    client.start()
+ 
\ No newline at end of file
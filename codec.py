@@ -0,0 +1,179 @@
+import json
+import struct
+import zlib
+
+# Frequent keys and values are sent as a one-byte index into this table instead of
+# the whole string. Only ever append to it: both ends must agree on the indexes.
+STRINGS = [
+    "type", "status", "message", "success", "error", "request_id", "codec", "notification_port",
+    "channel_name", "channel", "channels", "name", "description", "creator", "subscriber_count",
+    "news", "content", "author", "timestamp", "seq", "subscriptions", "cursor", "limit", "next_cursor",
+    "has_more", "notification_hello", "list_channels", "create_channel", "delete_channel", "subscribe",
+    "unsubscribe", "publish_news", "get_subscriptions", "get_news", "new_channel", "channel_deleted",
+    "new_news", "News published successfully", "Channel does not exist", "json", "binary",
+    "stats", "version", "since_version", "full", "deleted", "prefix", "search", "patterns", "followed",
+    "publish_batch", "contents", "news_batch", "published", "blocked", "coalesce_ms",
+    "heartbeat", "idle_timeout", "token", "durable",
+]
+STRING_INDEX = {string: i for i, string in enumerate(STRINGS)}
+
+BINARY_MAGIC = 0xB0  # High nibble of a binary body's first byte; JSON bodies start with '{'
+COMPRESSED = 0x01
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, KNOWN_STR, LIST, DICT, JSON = range(0x80, 0x8A)  # Below 0x80: small int
+DOUBLE = struct.Struct(">d")
+# Lists at least this long go out as JSON text when the frame is compressed. The tagged encoding is a
+# Python loop over every value, json's is C, and on a frame this size zlib saves what the string table would
+BULK_LIST = 16
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, obj):
+        return json.dumps(obj).encode()
+
+class BinaryCodec:
+    """Tagged binary encoding with a shared string table and optional zlib per frame"""
+
+    name = "binary"
+
+    def __init__(self, compress_threshold=1024):
+        self.compress_threshold = compress_threshold
+
+    def encode(self, obj):
+        out = bytearray()
+        write_value(out, obj, self.compress_threshold is not None)
+        if self.compress_threshold is not None and len(out) > self.compress_threshold:
+            compressed = zlib.compress(out, 1)
+            if len(compressed) < len(out):
+                return bytes((BINARY_MAGIC | COMPRESSED,)) + compressed
+        return bytes((BINARY_MAGIC,)) + out
+
+def write_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def write_value(out, value, bulk=False):
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(value)
+        else:
+            out.append(INT)
+            write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    elif isinstance(value, str):
+        index = STRING_INDEX.get(value)
+        if index is not None:
+            out.append(KNOWN_STR)
+            out.append(index)
+        else:
+            data = value.encode()
+            out.append(STR)
+            write_varint(out, len(data))
+            out += data
+    elif isinstance(value, dict):
+        out.append(DICT)
+        write_varint(out, len(value))
+        for key, item in value.items():
+            write_value(out, key)
+            write_value(out, item, bulk)
+    elif isinstance(value, (list, tuple)):
+        if bulk and len(value) >= BULK_LIST:
+            data = json.dumps(value).encode()
+            out.append(JSON)
+            write_varint(out, len(data))
+            out += data
+            return
+        out.append(LIST)
+        write_varint(out, len(value))
+        for item in value:
+            write_value(out, item, bulk)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__}")
+
+def read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+def read_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag < 0x80:
+        return tag, pos
+    if tag == KNOWN_STR:
+        return STRINGS[data[pos]], pos + 1
+    if tag == STR:
+        length, pos = read_varint(data, pos)
+        return str(data[pos:pos + length], "utf-8"), pos + length
+    if tag == DICT:
+        count, pos = read_varint(data, pos)
+        result = {}
+        for _ in range(count):
+            key, pos = read_value(data, pos)
+            result[key], pos = read_value(data, pos)
+        return result, pos
+    if tag == LIST:
+        count, pos = read_varint(data, pos)
+        result = []
+        for _ in range(count):
+            item, pos = read_value(data, pos)
+            result.append(item)
+        return result, pos
+    if tag == INT:
+        n, pos = read_varint(data, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    if tag == JSON:
+        length, pos = read_varint(data, pos)
+        return json.loads(bytes(data[pos:pos + length])), pos + length
+    if tag == FLOAT:
+        return DOUBLE.unpack_from(data, pos)[0], pos + 8
+    if tag == NONE:
+        return None, pos
+    if tag == TRUE:
+        return True, pos
+    if tag == FALSE:
+        return False, pos
+    raise ValueError(f"Unknown tag 0x{tag:02x}")
+
+class FrameTooLarge(ValueError):
+    pass
+
+def decode(body, max_size=None):
+    """Decode a frame body in either codec; the first byte tells them apart.
+    max_size bounds what a compressed body may expand to."""
+    if body[0] & 0xF0 != BINARY_MAGIC:
+        return json.loads(body)
+    payload = body[1:]
+    if body[0] & COMPRESSED:
+        if max_size is None:
+            payload = zlib.decompress(payload)
+        else:
+            decompressor = zlib.decompressobj()
+            payload = decompressor.decompress(payload, max_size)
+            if decompressor.unconsumed_tail:
+                raise FrameTooLarge(f"Frame expands beyond {max_size} bytes")
+    return read_value(memoryview(payload), 0)[0]
+
+def encode_frame(obj, codec):
+    """Length-prefixed frame, built once and shared by every recipient"""
+    body = codec.encode(obj)
+    return len(body).to_bytes(4, 'big') + body
+
+def make_codecs(compress_threshold=1024):
+    return {"json": JsonCodec(), "binary": BinaryCodec(compress_threshold)}
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from collections import deque
+
+class ContentFilter:
+    """Aho-Corasick matcher over the forbidden word list.
+
+    Each message is scanned once regardless of how many words are loaded. The
+    automaton is rebuilt off to the side and swapped in with one assignment,
+    so the word list can be reloaded while the server keeps filtering.
+    """
+
+    # Below this many words, str's C substring search beats walking the automaton in Python
+    SMALL_LIST = 32
+
+    def __init__(self, words=(), whole_word=False):
+        self.whole_word = whole_word
+        self.path = None
+        self.mtime = None
+        self.automaton = self.build(words)
+
+    @classmethod
+    def build(cls, words):
+        words = [word.strip().lower() for word in words]
+        words = [word for word in words if word]
+        small = tuple(words) if len(words) <= cls.SMALL_LIST else None
+        goto = [{}]  # state -> {char: next state}
+        fail = [0]
+        out = [()]  # state -> lengths of the words ending here, including via fail links
+        for word in words:
+            state = 0
+            for char in word:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                    goto[state][char] = next_state
+                state = next_state
+            if len(word) not in out[state]:
+                out[state] += (len(word),)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                target = goto[fallback].get(char, 0)
+                fail[next_state] = target if target != next_state else 0
+                out[next_state] += out[fail[next_state]]
+        return goto, fail, out, small
+
+    def allows(self, content):
+        return not self.matches(content)
+
+    def matches(self, content):
+        goto, fail, out, small = self.automaton
+        text = content.lower()
+        if small is not None and not self.whole_word:
+            return any(word in text for word in small)
+        state = 0
+        for i, char in enumerate(text):
+            while True:
+                next_state = goto[state].get(char)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            if out[state]:
+                if not self.whole_word:
+                    return True
+                end = i + 1
+                if end < len(text) and text[end].isalnum():
+                    continue
+                for length in out[state]:
+                    start = i + 1 - length
+                    if start == 0 or not text[start - 1].isalnum():
+                        return True
+        return False
+
+    def load(self, path):
+        """Replace the word list with the terms in path, one per line; '#' starts a comment"""
+        with open(path, encoding="utf-8") as f:
+            words = [line.split("#", 1)[0] for line in f]
+        self.mtime = os.path.getmtime(path)
+        self.path = path
+        self.automaton = self.build(words)
+
+    def watch(self, path, interval=2.0):
+        """Load path now and reload it whenever its modification time changes"""
+        self.load(path)
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    if os.path.getmtime(path) != self.mtime:
+                        self.load(path)
+                        print(f"Reloaded forbidden words from {path}")
+                except OSError:
+                    pass
+        threading.Thread(target=poll, name="filter-reload", daemon=True).start()
@@ -0,0 +1,139 @@
+import heapq
+import queue
+import threading
+import time
+from collections import deque
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+
+class DeliveryScheduler:
+    """Fixed pool of workers draining a bounded outbound queue per subscriber.
+
+    A subscriber's queue is handled by at most one worker at a time, so frames
+    reach each subscriber in the order they were submitted. Frames that piled
+    up for one subscriber go out in a single write.
+    """
+
+    def __init__(self, send, workers=8, queue_size=1024, overflow="drop_oldest", batch=64):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}'")
+        self.send = send  # send(connection, data) -> bool
+        self.workers = workers
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.batch = batch
+        self.queues = {}  # connection -> deque of pending items
+        self.scheduled = set()  # connections sitting in self.ready or being drained
+        self.ready = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f"delivery-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, connections, frame):
+        evicted = []
+        with self.lock:
+            for connection in connections:
+                if connection.closed:
+                    continue
+                pending = self.queues.get(connection)
+                if pending is None:
+                    pending = self.queues[connection] = deque()
+                if len(pending) >= self.queue_size:
+                    if self.overflow == "drop_newest":
+                        self.dropped += 1
+                        continue
+                    if self.overflow == "drop_oldest":
+                        pending.popleft()
+                        self.dropped += 1
+                    else:
+                        self.dropped += len(pending) + 1
+                        self.disconnected += 1
+                        pending.clear()
+                        if connection not in self.scheduled:
+                            del self.queues[connection]
+                        evicted.append(connection)
+                        continue
+                pending.append(frame)
+                if connection not in self.scheduled:
+                    self.scheduled.add(connection)
+                    self.ready.put(connection)
+        for connection in evicted:
+            connection.close()
+
+    def work(self):
+        while True:
+            connection = self.ready.get()
+            with self.lock:
+                pending = self.queues.get(connection, ())
+                frames = [pending.popleft() for _ in range(min(self.batch, len(pending)))]
+            ok = True
+            if frames:
+                try:
+                    ok = self.send(connection, frames[0] if len(frames) == 1 else b"".join(frames))
+                except Exception:
+                    ok = False
+            with self.lock:
+                if ok:
+                    self.delivered += len(frames)
+                else:
+                    self.failed += len(frames)
+                if self.queues.get(connection):
+                    # Requeue behind other subscribers instead of draining one greedily
+                    self.ready.put(connection)
+                else:
+                    self.queues.pop(connection, None)
+                    self.scheduled.discard(connection)
+
+    def stats(self):
+        with self.lock:
+            depths = [len(pending) for pending in self.queues.values()]
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "overflow": self.overflow,
+                "queued": sum(depths),
+                "max_depth": max(depths, default=0),
+                "backlogged_subscribers": len(depths),
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "disconnected": self.disconnected
+            }
+
+class Timers:
+    """Runs callbacks after a delay on one shared thread, started on first use"""
+
+    def __init__(self):
+        self.heap = []  # (due, sequence, callback, args)
+        self.sequence = 0
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def call_later(self, delay, callback, *args):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="timers", daemon=True)
+                self.thread.start()
+            self.sequence += 1
+            heapq.heappush(self.heap, (time.monotonic() + delay, self.sequence, callback, args))
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, callback, args = heapq.heappop(self.heap)
+            try:
+                callback(*args)
+            except Exception:
+                pass
@@ -0,0 +1,110 @@
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+class ChannelDirectory:
+    """Sorted, versioned cache of the channel listing.
+
+    Each channel's listing entry is built when the channel changes, not on
+    every list_channels, and every change bumps the version. A client that
+    remembers the version it last saw gets back only what changed since.
+    Versions are opaque "epoch:counter" tokens; a restarted server has a new
+    epoch, so tokens from before the restart fall back to a full listing.
+    """
+
+    def __init__(self, history=4096):
+        self.epoch = os.urandom(4).hex()
+        self.version = 0
+        self.entries = {}  # channel name -> listing entry, replaced rather than mutated
+        self.names = []  # Sorted channel names, for paging and prefix search
+        self.changes = deque(maxlen=history)  # (version, channel name), oldest first
+        self.lock = threading.Lock()
+
+    def token(self):
+        return f"{self.epoch}:{self.version}"
+
+    def put(self, channel):
+        """Add channel or refresh its entry, e.g. after its subscriber count changed"""
+        with self.lock:
+            # Built under the lock so the last of several concurrent updates sees the final state
+            entry = channel.to_dict()
+            previous = self.entries.get(channel.name)
+            if previous == entry:
+                return
+            if previous is None:
+                insort(self.names, channel.name)
+            self.entries[channel.name] = entry
+            self.changed(channel.name)
+
+    def remove(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) is None:
+                return
+            del self.names[bisect_left(self.names, name)]
+            self.changed(name)
+
+    def reset(self, channels):
+        with self.lock:
+            self.entries = {channel.name: channel.to_dict() for channel in channels}
+            self.names = sorted(self.entries)
+            self.changes.clear()
+            self.version += 1
+
+    def changed(self, name):
+        self.version += 1
+        self.changes.append((self.version, name))
+
+    def page(self, cursor=None, limit=None, prefix="", search=""):
+        """Entries with names after cursor, in name order: (entries, next_cursor, has_more, version)"""
+        search = search.lower()
+        with self.lock:
+            start = bisect_right(self.names, cursor) if cursor else 0
+            if prefix:
+                start = max(start, bisect_left(self.names, prefix))
+            page = []
+            has_more = False
+            for i in range(start, len(self.names)):
+                name = self.names[i]
+                if prefix and not name.startswith(prefix):
+                    break
+                if search and search not in name.lower():
+                    continue
+                if limit is not None and len(page) == limit:
+                    has_more = True
+                    break
+                page.append(self.entries[name])
+            version = self.token()
+        next_cursor = page[-1]["name"] if page else cursor
+        return page, next_cursor, has_more, version
+
+    def delta(self, since, prefix="", search=""):
+        """(changed entries, deleted names, version) since the given version, or None when the
+        changes are no longer retained and the client needs a full listing"""
+        epoch, _, counter = str(since).partition(":")
+        if epoch != self.epoch or not counter.isdigit():
+            return None
+        since = int(counter)
+        search = search.lower()
+        with self.lock:
+            if since > self.version:
+                return None
+            oldest = self.changes[0][0] if self.changes else self.version + 1
+            if since < oldest - 1 and since != self.version:
+                return None
+            names = set()
+            for version, name in reversed(self.changes):
+                if version <= since:
+                    break
+                names.add(name)
+            changed = []
+            deleted = []
+            for name in sorted(names):
+                if (prefix and not name.startswith(prefix)) or (search and search not in name.lower()):
+                    continue
+                entry = self.entries.get(name)
+                if entry is None:
+                    deleted.append(name)
+                else:
+                    changed.append(entry)
+            return changed, deleted, self.token()
@@ -0,0 +1,237 @@
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import threading
+import time
+
+import client
+from client import Client
+
+MIX = {"publish_news": 6, "subscribe": 1, "unsubscribe": 1, "list_channels": 2}
+STAMP = "loadgen@"  # Published content starts with this and the send time, read back on delivery
+
+class SimulatedClient(Client):
+    """A Client whose notification listener records delivery latency instead of printing"""
+
+    def __init__(self, stats, codec="json"):
+        super().__init__(codec)
+        self.stats = stats
+        self.owned = []
+        self.subscribed = set()
+
+    def start(self):
+        self.setup_notification_listener()
+        self.announce_notification_port()
+        self.receive_thread = threading.Thread(target=self.receive_notifications, daemon=True)
+        self.receive_thread.start()
+
+    def process_notification(self, notification, addr):
+        received = time.time()
+        if notification.get("type") != "new_news":
+            self.stats.other_notifications += 1
+            return
+        content = notification["news"]["content"]
+        if content.startswith(STAMP):
+            self.stats.delivery.append(received - float(content[len(STAMP):].split(" ", 1)[0]))
+
+    def close(self):
+        for sock in (self.sock, self.notification_sock):
+            if sock:
+                sock.close()
+
+class WorkerStats:
+    def __init__(self):
+        self.latency = {req_type: [] for req_type in MIX}
+        self.errors = {req_type: 0 for req_type in MIX}
+        self.unanswered = 0
+        self.delivery = []
+        self.other_notifications = 0
+        self.sent = 0
+        self.recording = False
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        req_type, _, weight = part.partition("=")
+        if req_type not in MIX:
+            raise argparse.ArgumentTypeError(f"Unknown request type '{req_type}'")
+        mix[req_type] = float(weight or 1)
+    return mix
+
+def raise_fd_limit():
+    # Every simulated client holds a request socket, a listener and the server's notification connection
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def summarize(values):
+    values = sorted(values)
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {"count": len(values), "p50_ms": ms(percentile(values, 50)), "p99_ms": ms(percentile(values, 99)),
+            "max_ms": ms(values[-1] if values else None)}
+
+def channel_name(worker, i):
+    return f"loadgen-{worker}-{i}"
+
+def clients_in(args, worker):
+    return args.clients // args.processes + (worker < args.clients % args.processes)
+
+def run_worker(args, worker, setup, results):
+    """Drive this process's share of the clients; the request rate is open-loop so a slow server
+    shows up as latency instead of quietly lowering the offered load"""
+    client.HOST = args.host
+    client.SERVER_PORT = args.port
+    raise_fd_limit()
+    stats = WorkerStats()
+    clients = [SimulatedClient(stats, args.codec) for _ in range(clients_in(args, worker))]
+    for sim in clients:
+        sim.start()
+    owners = clients[:args.channels_per_process]
+    for i, owner in enumerate(owners):
+        name = channel_name(worker, i)
+        owner.send_request({"type": "create_channel", "channel_name": name, "description": "loadgen",
+                            "notification_port": owner.notification_port})
+        owner.owned.append(name)
+    setup.wait()
+    # Every process has created its channels by now
+    names = [channel_name(w, i) for w in range(args.processes)
+             for i in range(min(args.channels_per_process, clients_in(args, w)))]
+    for sim in clients:
+        sim.subscribed = set(random.sample(names, min(args.subscriptions, len(names))))
+        for future in sim.send_requests_async([{"type": "subscribe", "channel_name": name} for name in sim.subscribed]):
+            future.result()
+    setup.wait()
+
+    req_types = list(args.mix)
+    weights = [args.mix[req_type] for req_type in req_types]
+    padding = "x" * max(0, args.size - 32)
+    interval = args.processes / args.rate
+    outstanding = []
+    started = time.monotonic()
+    warmup_end = started + args.warmup
+    end = warmup_end + args.duration
+    scheduled = started
+    while scheduled < end:
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if not stats.recording and scheduled >= warmup_end:
+            stats.recording = True
+            stats.delivery.clear()
+        req_type = random.choices(req_types, weights)[0]
+        if req_type == "publish_news":
+            sim = random.choice(owners)
+            request = {"type": req_type, "channel_name": random.choice(sim.owned),
+                       "content": f"{STAMP}{time.time():.6f} {padding}"}
+        elif req_type == "subscribe":
+            sim = random.choice(clients)
+            name = random.choice(names)
+            sim.subscribed.add(name)
+            request = {"type": req_type, "channel_name": name}
+        elif req_type == "unsubscribe":
+            sim = random.choice(clients)
+            if not sim.subscribed:
+                scheduled += interval
+                continue
+            request = {"type": req_type, "channel_name": sim.subscribed.pop()}
+        else:
+            sim = random.choice(clients)
+            request = {"type": req_type}
+        future = sim.send_request_async(request)
+        if stats.recording:
+            stats.sent += 1
+            # Latency is measured from when the request was due, not when the driver got to it
+            future.add_done_callback(lambda future, req_type=req_type, due=scheduled:
+                                     record(stats, req_type, due, future.result()))
+            outstanding.append(future)
+        scheduled += interval
+
+    drain_end = time.monotonic() + args.drain
+    unanswered = 0
+    for future in outstanding:
+        if not future.done():
+            try:
+                future.result(timeout=max(0, drain_end - time.monotonic()))
+            except Exception:
+                unanswered += 1
+    stats.unanswered = unanswered
+    time.sleep(max(0, drain_end - time.monotonic()))
+    results.put({"latency": stats.latency, "errors": stats.errors, "unanswered": stats.unanswered,
+                 "delivery": list(stats.delivery), "sent": stats.sent})
+    for owner in owners:
+        for name in owner.owned:
+            owner.send_request({"type": "delete_channel", "channel_name": name})
+    for sim in clients:
+        sim.close()
+
+def record(stats, req_type, due, response):
+    stats.latency[req_type].append(time.monotonic() - due)
+    if response.get("status") != "success":
+        stats.errors[req_type] += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the news channel server")
+    parser.add_argument("--host", default=client.HOST)
+    parser.add_argument("--port", type=int, default=client.SERVER_PORT)
+    parser.add_argument("--clients", type=int, default=1000, help="Simulated clients, each with a notification listener")
+    parser.add_argument("--processes", type=int, default=4, help="Load generator processes sharing the clients")
+    parser.add_argument("--channels-per-process", type=int, default=10)
+    parser.add_argument("--subscriptions", type=int, default=3, help="Channels each client subscribes to at start")
+    parser.add_argument("--rate", type=float, default=1000, help="Requests per second across all clients")
+    parser.add_argument("--mix", type=parse_mix, default=MIX,
+                        help="Request weights, e.g. publish_news=6,subscribe=1,unsubscribe=1,list_channels=2")
+    parser.add_argument("--size", type=int, default=100, help="Approximate published content size in bytes")
+    parser.add_argument("--codec", choices=["json", "binary"], default="json")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--drain", type=float, default=2, help="Seconds to wait for late responses and notifications")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object instead of a table")
+    args = parser.parse_args()
+    args.processes = max(1, min(args.processes, args.clients))
+
+    setup = multiprocessing.Barrier(args.processes + 1)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker, args=(args, worker, setup, results), daemon=True)
+               for worker in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    setup.wait()
+    setup.wait()
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join(10)
+
+    report = {"config": {key: value for key, value in vars(args).items() if key != "json"}, "requests": {}}
+    total = 0
+    for req_type in args.mix:
+        latencies = [value for result in collected for value in result["latency"][req_type]]
+        total += len(latencies)
+        report["requests"][req_type] = dict(summarize(latencies),
+                                            errors=sum(result["errors"][req_type] for result in collected))
+    report["unanswered"] = sum(result["unanswered"] for result in collected)
+    report["requests_per_s"] = round(total / args.duration, 1)
+    delivery = [value for result in collected for value in result["delivery"]]
+    report["delivery"] = summarize(delivery)
+    report["notifications_per_s"] = round(len(delivery) / args.duration, 1)
+
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"{args.clients} clients, {args.rate:g} req/s offered for {args.duration:g}s, "
+          f"{report['requests_per_s']:g} req/s answered")
+    print(f"{'request':<16}{'count':>9}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(report["requests"].items()) + [("delivery", dict(report["delivery"], errors=0))]
+    for name, row in rows:
+        print(f"{name:<16}{row['count']:>9}{row['errors']:>8}" + "".join(
+            f"{'-' if row[key] is None else row[key]:>10}" for key in ("p50_ms", "p99_ms", "max_ms")))
+    print(f"notifications/s: {report['notifications_per_s']:g}, unanswered requests: {report['unanswered']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds, from 50µs to 10s
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    """Latency distribution over fixed buckets; recording is a bisect and two additions"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last slot catches everything above BUCKETS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def state(self):
+        with self.lock:
+            return list(self.counts), self.count, self.sum, self.max
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation"""
+        counts, count, _, largest = self.state()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, n in zip(BUCKETS, counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, largest)
+        return largest
+
+    def to_dict(self):
+        ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+        return {"count": self.count, "sum_ms": ms(self.sum), "p50_ms": ms(self.quantile(0.5)),
+                "p99_ms": ms(self.quantile(0.99)), "max_ms": ms(self.max)}
+
+class TimedLock:
+    """threading.Lock that records how long contended acquisitions waited"""
+
+    def __init__(self, histogram):
+        self.lock = threading.Lock()
+        self.histogram = histogram
+
+    def __enter__(self):
+        # The clock is only read when the lock is actually contended
+        if not self.lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            self.histogram.observe(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+class Metrics:
+    """Counters and latency histograms keyed by (name, label), created on first use"""
+
+    def __init__(self, prefix="news", label_names=None):
+        self.prefix = prefix
+        self.label_names = label_names or {}  # metric name -> what its label means, for render()
+        self.started = time.time()
+        self.counters = {}  # (name, label) -> int
+        self.histograms = {}  # (name, label) -> Histogram
+        self.lock = threading.Lock()
+
+    def inc(self, name, label=None, n=1):
+        key = (name, label)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def histogram(self, name, label=None):
+        key = (name, label)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, label, seconds):
+        self.histogram(name, label).observe(seconds)
+
+    def counter(self, name, label=None):
+        return self.counters.get((name, label), 0)
+
+    def items(self):
+        key = lambda item: (item[0][0], item[0][1] or "")
+        with self.lock:
+            return sorted(self.counters.items(), key=key), sorted(self.histograms.items(), key=key)
+
+    def snapshot(self, gauges=None):
+        """JSON-friendly view: {name: value} or {name: {label: value}} per metric"""
+        counters, histograms = self.items()
+        result = {"uptime_s": round(time.time() - self.started, 1), "gauges": dict(gauges or {}),
+                  "counters": {}, "histograms": {}}
+        for (name, label), value in counters:
+            if label is None:
+                result["counters"][name] = value
+            else:
+                result["counters"].setdefault(name, {})[label] = value
+        for (name, label), histogram in histograms:
+            if label is None:
+                result["histograms"][name] = histogram.to_dict()
+            else:
+                result["histograms"].setdefault(name, {})[label] = histogram.to_dict()
+        return result
+
+    def render(self, gauges=None):
+        """Prometheus text exposition format"""
+        counters, histograms = self.items()
+        lines = []
+
+        def labels(name, label, extra=""):
+            parts = [f'{self.label_names.get(name, "label")}="{label}"'] if label is not None else []
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        typed = set()
+        for (name, label), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+            lines.append(f"{self.prefix}_{name}{labels(name, label)} {value}")
+        for (name, label), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            counts, count, total, _ = histogram.state()
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.prefix}_{name}_bucket{labels(name, label, le)} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_sum{labels(name, label)} {total}")
+            lines.append(f"{self.prefix}_{name}_count{labels(name, label)} {count}")
+        return "\n".join(lines) + "\n"
+
+def serve_metrics(render, host, port):
+    """Answer every HTTP GET on host:port with render() as plain text, from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    listener = ThreadingHTTPServer((host, port), Handler)
+    listener.daemon_threads = True
+    threading.Thread(target=listener.serve_forever, name="metrics", daemon=True).start()
+    return listener
@@ -1,42 +1,166 @@
+import argparse
+import hashlib
 import socket
-import json
 import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import count, islice
+
+from codec import FrameTooLarge, decode, encode_frame, make_codecs
+from content_filter import ContentFilter
+from delivery import OVERFLOW_POLICIES, DeliveryScheduler, Timers
+from directory import ChannelDirectory
+from metrics import Metrics, TimedLock, serve_metrics
+from storage import Storage
+from topics import TopicTrie, is_pattern, valid_pattern
 
 HOST = "127.0.0.1"
 PORT = 3333
+OWNER_KEY = "key:"  # Prefix of owners derived from a client token, the only ones that outlive a connection
+
+def token_owner(token):
+    # The log keeps a digest, so reading it does not hand out the token
+    return OWNER_KEY + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+def durable_owner(owner):
+    return owner if owner and owner.startswith(OWNER_KEY) else None
 
 class Message:
-    def __init__(self, content, author, timestamp):
+    __slots__ = ("seq", "content", "author", "timestamp")
+
+    def __init__(self, seq, content, author, timestamp):
+        self.seq = seq
         self.content = content
         self.author = author
-        self.timestamp = timestamp
+        self.timestamp = timestamp  # Epoch seconds, formatted only when serialized
 
     def to_dict(self):
         return {
+            "seq": self.seq,
             "content": self.content,
             "author": self.author,
-            "timestamp": self.timestamp
+            "timestamp": datetime.fromtimestamp(self.timestamp).strftime("%Y-%m-%d %H:%M:%S")
         }
 
+class RWLock:
+    """Many concurrent readers or a single writer; a waiting writer blocks new readers"""
+
+    def __init__(self, wait_histogram=None):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+        self.wait_histogram = wait_histogram  # Records how long blocked acquisitions waited
+
+    def wait_for(self, ready):
+        if not ready():
+            start = time.perf_counter()
+            self.cond.wait_for(ready)
+            if self.wait_histogram is not None:
+                self.wait_histogram.observe(time.perf_counter() - start)
+
+    @contextmanager
+    def read(self):
+        with self.cond:
+            self.wait_for(lambda: not (self.writer or self.writers_waiting))
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.cond:
+            self.writers_waiting += 1
+            self.wait_for(lambda: not (self.writer or self.readers))
+            self.writers_waiting -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer = False
+                self.cond.notify_all()
+
 class Channel:
-    def __init__(self, name, description, creator):
+    def __init__(self, name, description, creator, max_news=1000, max_age=None, coalesce_ms=0, owner=None):
         self.name = name
         self.description = description
         self.creator = creator
-        self.news = []
+        self.owner = owner  # Who may publish and delete; None until a client adopts a recovered channel
+        self.coalesce_ms = coalesce_ms  # Window for merging notifications into one news_batch, 0 sends each
+        self.pending_news = []  # News published during the current window, not yet notified
+        self.news = deque(maxlen=max_news)  # Oldest news falls off once the history is full
+        self.max_age = max_age  # Seconds a news item is retained, None keeps it until evicted
+        self.next_seq = 1
         self.subscribers = set()  # Set of client_ids
+        self.lock = threading.RLock()  # Guards news and subscribers
 
     def add_news(self, content, author):
-        news = Message(content, author, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        self.news.append(news)
+        with self.lock:
+            news = Message(self.next_seq, content, author, int(time.time()))
+            self.next_seq += 1
+            self.news.append(news)
+            self.expire_news(news.timestamp)
         return news
 
+    def take_pending_news(self):
+        with self.lock:
+            pending, self.pending_news = self.pending_news, []
+            return pending
+
+    def restore_news(self, seq, content, author, timestamp):
+        self.news.append(Message(seq, content, author, timestamp))
+        self.next_seq = seq + 1
+
+    def to_snapshot(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "description": self.description,
+                "creator": self.creator,
+                "owner": durable_owner(self.owner),
+                "coalesce_ms": self.coalesce_ms,
+                "next_seq": self.next_seq,
+                "news": [[news.seq, news.content, news.author, news.timestamp] for news in self.news]
+            }
+
+    def expire_news(self, now):
+        if self.max_age is not None:
+            while self.news and self.news[0].timestamp < now - self.max_age:
+                self.news.popleft()
+
+    def get_news(self, cursor, limit):
+        """Up to limit news with seq greater than cursor, plus the cursor for the next page"""
+        with self.lock:
+            self.expire_news(int(time.time()))
+            if not self.news:
+                return [], cursor, False
+            # Sequence numbers are contiguous in the deque, so the cursor maps to an offset
+            start = max(0, cursor + 1 - self.news[0].seq)
+            page = [news.to_dict() for news in islice(self.news, start, start + limit)]
+            has_more = start + limit < len(self.news)
+        next_cursor = page[-1]["seq"] if page else max(cursor, self.next_seq - 1)
+        return page, next_cursor, has_more
+
     def subscribe(self, client_id):
-        self.subscribers.add(client_id)
+        with self.lock:
+            self.subscribers.add(client_id)
 
     def unsubscribe(self, client_id):
-        self.subscribers.discard(client_id)
+        with self.lock:
+            self.subscribers.discard(client_id)
+
+    def subscriber_snapshot(self, extra=()):
+        """Current subscribers, merged with extra client_ids without duplicates"""
+        with self.lock:
+            return self.subscribers.union(extra) if extra else list(self.subscribers)
 
     def to_dict(self):
         return {
@@ -46,144 +170,521 @@ class Channel:
             "subscriber_count": len(self.subscribers)
         }
 
+class NotificationConnection:
+    def __init__(self, host, port, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.closed = False
+        self.client_id = None  # Set by the server that registered this listener
+        self.codec = None  # Negotiated in notification_hello
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data):
+        """Write a frame over the long-lived connection, reconnecting once if it broke"""
+        with self.lock:
+            try:
+                for _ in range(2):
+                    if self.closed:
+                        return False
+                    try:
+                        if self.sock is None:
+                            self.connect()
+                        self.sock.sendall(data)
+                        return True
+                    except OSError:
+                        self.reset()
+                return False
+            finally:
+                if self.closed:
+                    # close() could not take the lock while this send held it
+                    self.reset()
+
+    def reset(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def close(self):
+        """Close without waiting for a send in progress: shutdown makes that send fail, and it then
+        releases the socket itself"""
+        self.closed = True
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.lock.acquire(blocking=False):
+            try:
+                self.reset()
+            finally:
+                self.lock.release()
+
+class PeerLimiter:
+    """Open connections per peer address, refusing new ones over the limit"""
+
+    def __init__(self, limit=None):
+        self.limit = limit  # None or 0 means unlimited
+        self.counts = {}  # host -> open connections
+        self.lock = threading.Lock()
+
+    def acquire(self, host):
+        with self.lock:
+            count = self.counts.get(host, 0)
+            if self.limit and count >= self.limit:
+                return False
+            self.counts[host] = count + 1
+            return True
+
+    def release(self, host):
+        with self.lock:
+            count = self.counts.pop(host, 0) - 1
+            if count > 0:
+                self.counts[host] = count
+
+TOO_MANY_CONNECTIONS = {"status": "error", "message": "Too many connections from this address"}
+FRAME_TOO_LARGE = {"status": "error", "message": "Frame too large"}
+
 class Server:
-    def __init__(self):
+    MAX_NEWS_PAGE = 500
+    MAX_CHANNEL_PAGE = 1000
+    MAX_PUBLISH_BATCH = 1000
+    REQUEST_TYPES = ("notification_hello", "list_channels", "create_channel", "delete_channel", "subscribe",
+                     "unsubscribe", "publish_news", "publish_batch", "get_subscriptions", "get_news", "stats",
+                     "heartbeat", "client_disconnected")
+
+    def __init__(self, host=HOST, port=PORT, delivery_workers=8, queue_size=1024, overflow="drop_oldest",
+                 news_history=1000, news_max_age=None, storage=None, forbidden_words_file=None, whole_word=False,
+                 compress_threshold=1024, trusted_proxy=False, metrics_port=None, coalesce_ms=0,
+                 backlog=1024, idle_timeout=120, read_timeout=10, heartbeat_interval=30, max_frame_bytes=1 << 20,
+                 max_connections_per_peer=None):
+        self.host = host
+        self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((HOST, PORT))
+        self.sock.bind((host, port))
+        self.backlog = backlog
+        # Behind a shard router the only peer is the router, whose links must stay open while idle
+        self.idle_timeout = None if trusted_proxy else idle_timeout  # Seconds a connection may wait between requests
+        self.read_timeout = read_timeout  # Seconds to receive the rest of a started frame, or to send a response
+        self.heartbeat_interval = heartbeat_interval  # Seconds between heartbeats on notification connections
+        self.max_frame_bytes = max_frame_bytes
+        self.peers = PeerLimiter(None if trusted_proxy else max_connections_per_peer)
         self.channels = {}  # channel_name -> Channel object
+        self.directory = ChannelDirectory()  # Versioned listing served by list_channels
         self.client_notification_ports = {}  # client_id -> notification_port
         self.client_addresses = {}  # client_id -> (ip, port)
-        self.lock = threading.Lock()
+        self.notification_connections = {}  # client_id -> NotificationConnection
+        self.subscriptions = {}  # client_id -> set of channel names, mirrors Channel.subscribers
+        self.patterns = TopicTrie()  # Wildcard subscriptions such as 'sports/*' or 'markets/#'
+        self.pattern_subscriptions = {}  # client_id -> set of patterns, mirrors self.patterns
+        self.codecs = make_codecs(compress_threshold)
+        self.trusted_proxy = trusted_proxy  # Accept client identities forwarded by a shard router
+        self.client_codecs = {}  # client_id -> codec negotiated in notification_hello
+        self.client_owners = {}  # client_id -> owner identity, from the token sent in notification_hello
+        self.owner_serials = count(1)
+        self.metrics = Metrics(label_names={"request_seconds": "type", "request_errors_total": "type",
+                                            "lock_wait_seconds": "lock", "fanout_seconds": "type"})
+        self.metrics_port = metrics_port
+        # Guards the client registration maps above
+        self.lock = TimedLock(self.metrics.histogram("lock_wait_seconds", "server"))
+        # Guards self.channels
+        self.channels_lock = RWLock(self.metrics.histogram("lock_wait_seconds", "channels"))
+        self.news_history = news_history
+        self.news_max_age = news_max_age
+        self.coalesce_ms = coalesce_ms  # Default coalescing window for channels that do not set one
+        self.timers = Timers()
+        self.scheduler = DeliveryScheduler(self.send_notification, delivery_workers, queue_size, overflow)
+        self.storage = storage
+        if storage is not None:
+            self.recover()
+            self.directory.reset(self.channels.values())
         self.forbidden_words = ["spam", "hack", "virus", "malware", "phishing", "scam"]
+        self.filter = ContentFilter(self.forbidden_words, whole_word)
+        if forbidden_words_file:
+            self.filter.watch(forbidden_words_file)
 
     def content_filter(self, content):
         """Filter content to check for forbidden words"""
-        content_lower = content.lower()
-        for word in self.forbidden_words:
-            if word in content_lower:
-                return False
-        return True
+        return self.filter.allows(content)
 
-    def handle_list_channels(self):
-        with self.lock:
-            channels_list = [channel.to_dict() for channel in self.channels.values()]
-            return {"status": "success", "channels": channels_list}
+    def handle_list_channels(self, since_version=None, cursor=None, limit=None, prefix="", search=""):
+        prefix = prefix or ""
+        search = search or ""
+        if since_version is not None:
+            delta = self.directory.delta(since_version, prefix, search)
+            if delta is not None:
+                changed, deleted, version = delta
+                return {"status": "success", "version": version, "full": False, "channels": changed, "deleted": deleted}
+        limit = max(1, min(int(limit), self.MAX_CHANNEL_PAGE)) if limit else None
+        channels, next_cursor, has_more, version = self.directory.page(cursor, limit, prefix, search)
+        return {"status": "success", "version": version, "full": True, "channels": channels,
+                "next_cursor": next_cursor, "has_more": has_more}
 
-    def handle_create_channel(self, channel_name, description, client_id):
-        with self.lock:
+    def handle_create_channel(self, channel_name, description, client_id, coalesce_ms=None):
+        if is_pattern(channel_name):
+            return {"status": "error", "message": "Channel names cannot contain '*' or '#' segments"}
+        with self.channels_lock.write():
             if channel_name in self.channels:
                 return {"status": "error", "message": "Channel already exists"}
-            channel = Channel(channel_name, description, client_id)
+            coalesce_ms = self.coalesce_ms if coalesce_ms is None else max(0, int(coalesce_ms))
+            owner = self.owner_of(client_id)
+            channel = Channel(channel_name, description, client_id, self.news_history, self.news_max_age, coalesce_ms,
+                              owner)
             self.channels[channel_name] = channel
-            def notify_async():
-                try:
-                    self.notify_all_clients({
-                        "type": "new_channel",
-                        "channel": channel.to_dict(),
-                        "message": f"New channel '{channel_name}' created"
-                    })
-                except Exception:
-                    pass
-            threading.Thread(target=notify_async, daemon=True).start()
-            return {"status": "success", "message": f"Channel '{channel_name}' created"}
+            self.directory.put(channel)
+            self.log({"op": "create_channel", "channel": channel_name, "description": description, "creator": client_id,
+                      "owner": durable_owner(owner), "coalesce_ms": coalesce_ms})
+            entry = channel.to_dict()
+        # Fan-out walks every listener, so it waits until other requests may use the channels again
+        self.enqueue_notification(self.notify_new_channel, channel, {
+            "type": "new_channel",
+            "channel": entry,
+            "message": f"New channel '{channel_name}' created"
+        })
+        return {"status": "success", "message": f"Channel '{channel_name}' created"}
 
     def handle_delete_channel(self, channel_name, client_id):
-        with self.lock:
+        with self.channels_lock.write():
             if channel_name not in self.channels:
                 return {"status": "error", "message": "Channel does not exist"}
             channel = self.channels[channel_name]
-            if channel.creator != client_id:
+            if not self.owns(channel, client_id):
                 return {"status": "error", "message": "Only the channel creator can delete it"}
             del self.channels[channel_name]
-            def notify_async():
-                try:
-                    self.notify_all_clients({
-                        "type": "channel_deleted",
-                        "channel_name": channel_name,
-                        "message": f"Channel '{channel_name}' has been deleted"
-                    })
-                except Exception:
-                    pass
-            threading.Thread(target=notify_async, daemon=True).start()
-            return {"status": "success", "message": f"Channel '{channel_name}' deleted"}
+            self.directory.remove(channel_name)
+            # News still waiting out a coalescing window goes out before the deletion notice
+            self.flush_news(channel)
+            self.forget_subscriptions(channel_name, channel.subscriber_snapshot())
+            self.log({"op": "delete_channel", "channel": channel_name})
+        self.enqueue_notification(self.notify_all_clients, {
+            "type": "channel_deleted",
+            "channel_name": channel_name,
+            "message": f"Channel '{channel_name}' has been deleted"
+        })
+        return {"status": "success", "message": f"Channel '{channel_name}' deleted"}
 
     def handle_subscribe(self, channel_name, client_id):
-        with self.lock:
+        if is_pattern(channel_name):
+            return self.handle_subscribe_pattern(channel_name, client_id)
+        with self.channels_lock.read():
             if channel_name not in self.channels:
                 return {"status": "error", "message": "Channel does not exist"}
             channel = self.channels[channel_name]
             channel.subscribe(client_id)
+            self.directory.put(channel)
+            with self.lock:
+                self.subscriptions.setdefault(client_id, set()).add(channel_name)
             return {"status": "success", "message": f"Subscribed to channel '{channel_name}'"}
 
     def handle_unsubscribe(self, channel_name, client_id):
-        with self.lock:
+        if is_pattern(channel_name):
+            return self.handle_unsubscribe_pattern(channel_name, client_id)
+        with self.channels_lock.read():
             if channel_name not in self.channels:
                 return {"status": "error", "message": "Channel does not exist"}
             channel = self.channels[channel_name]
             channel.unsubscribe(client_id)
+            self.directory.put(channel)
+            self.forget_subscriptions(channel_name, [client_id])
             return {"status": "success", "message": f"Unsubscribed from channel '{channel_name}'"}
 
+    def handle_subscribe_pattern(self, pattern, client_id):
+        if not valid_pattern(pattern):
+            return {"status": "error", "message": "'#' is only allowed as the last segment of a pattern"}
+        with self.channels_lock.read():
+            with self.lock:
+                self.pattern_subscriptions.setdefault(client_id, set()).add(pattern)
+            self.patterns.add(pattern, client_id)
+        return {"status": "success", "message": f"Subscribed to pattern '{pattern}'"}
+
+    def handle_unsubscribe_pattern(self, pattern, client_id):
+        with self.channels_lock.read():
+            with self.lock:
+                patterns = self.pattern_subscriptions.get(client_id, set())
+                if pattern not in patterns:
+                    return {"status": "error", "message": "Not subscribed to this pattern"}
+                patterns.discard(pattern)
+                if not patterns:
+                    del self.pattern_subscriptions[client_id]
+            self.patterns.remove(pattern, client_id)
+        return {"status": "success", "message": f"Unsubscribed from pattern '{pattern}'"}
+
     def handle_publish_news(self, channel_name, content, client_id):
-        with self.lock:
+        allowed = self.content_filter(content)
+        with self.channels_lock.read():
             if channel_name not in self.channels:
                 return {"status": "error", "message": "Channel does not exist"}
             channel = self.channels[channel_name]
-            if channel.creator != client_id:
+            if not self.owns(channel, client_id):
                 return {"status": "error", "message": "Only the channel creator can publish news"}
-            if not self.content_filter(content):
+            if not allowed:
                 return {"status": "error", "message": "News content contains forbidden words and has been blocked"}
-            news = channel.add_news(content, client_id)
-            def notify_async():
-                try:
-                    self.notify_subscribers(channel, {
-                        "type": "new_news",
-                        "channel_name": channel_name,
-                        "news": news.to_dict(),
-                        "message": f"New news in channel '{channel_name}'"
-                    })
-                except Exception:
-                    pass
-            threading.Thread(target=notify_async, daemon=True).start()
+            self.publish(channel, [content], client_id)
             return {"status": "success", "message": "News published successfully"}
 
+    def handle_publish_batch(self, channel_name, contents, client_id):
+        if not isinstance(contents, list) or not all(isinstance(content, str) for content in contents):
+            return {"status": "error", "message": "Contents must be a list of strings"}
+        if not contents or len(contents) > self.MAX_PUBLISH_BATCH:
+            return {"status": "error", "message": f"A batch holds between 1 and {self.MAX_PUBLISH_BATCH} news"}
+        blocked = [i for i, content in enumerate(contents) if not self.content_filter(content)]
+        with self.channels_lock.read():
+            if channel_name not in self.channels:
+                return {"status": "error", "message": "Channel does not exist"}
+            channel = self.channels[channel_name]
+            if not self.owns(channel, client_id):
+                return {"status": "error", "message": "Only the channel creator can publish news"}
+            if len(blocked) == len(contents):
+                return {"status": "error", "message": "News content contains forbidden words and has been blocked",
+                        "blocked": blocked}
+            skip = set(blocked)
+            self.publish(channel, [content for i, content in enumerate(contents) if i not in skip], client_id)
+            return {"status": "success", "message": f"Published {len(contents) - len(blocked)} news",
+                    "published": len(contents) - len(blocked), "blocked": blocked}
+
+    def owner_of(self, client_id):
+        with self.lock:
+            owner = self.client_owners.get(client_id)
+            if owner is None:
+                # Without a token the connection itself is the owner. The serial keeps a later connection
+                # from the same ip:port from inheriting its channels
+                owner = self.client_owners[client_id] = f"{client_id}#{next(self.owner_serials)}"
+            return owner
+
+    def owns(self, channel, client_id):
+        """Whether client_id may publish to and delete channel. A channel recovered without a durable
+        owner (created by a client that sent no token) is adopted by the first client to manage it."""
+        owner = self.owner_of(client_id)
+        with channel.lock:
+            if channel.owner is None:
+                channel.owner = owner
+                if durable_owner(owner):
+                    self.log({"op": "adopt_channel", "channel": channel.name, "owner": owner})
+            return channel.owner == owner
+
+    def publish(self, channel, contents, author):
+        # Enqueue while holding the channel lock so subscribers see news in publish order
+        with channel.lock:
+            items = []
+            for content in contents:
+                news = channel.add_news(content, author)
+                self.log({"op": "publish_news", "channel": channel.name, "seq": news.seq, "content": content,
+                          "author": author, "timestamp": news.timestamp})
+                items.append(news.to_dict())
+            if channel.coalesce_ms:
+                if not channel.pending_news:
+                    self.call_later(channel.coalesce_ms / 1000, self.flush_news, channel)
+                channel.pending_news.extend(items)
+            else:
+                self.enqueue_notification(self.notify_subscribers, channel, self.news_notification(channel.name, items))
+
+    def flush_news(self, channel):
+        with channel.lock:
+            items = channel.take_pending_news()
+            if items:
+                self.enqueue_notification(self.notify_subscribers, channel, self.news_notification(channel.name, items))
+
+    def news_notification(self, channel_name, items):
+        if len(items) == 1:
+            return {"type": "new_news", "channel_name": channel_name, "news": items[0],
+                    "message": f"New news in channel '{channel_name}'"}
+        return {"type": "news_batch", "channel_name": channel_name, "news": items,
+                "message": f"{len(items)} new news in channel '{channel_name}'"}
+
+    def call_later(self, delay, callback, *args):
+        self.timers.call_later(delay, callback, *args)
+
+    def handle_get_news(self, channel_name, cursor, limit):
+        limit = max(1, min(int(limit), self.MAX_NEWS_PAGE))
+        with self.channels_lock.read():
+            if channel_name not in self.channels:
+                return {"status": "error", "message": "Channel does not exist"}
+            news, next_cursor, has_more = self.channels[channel_name].get_news(int(cursor), limit)
+            return {"status": "success", "news": news, "next_cursor": next_cursor, "has_more": has_more}
+
     def handle_get_subscriptions(self, client_id):
+        with self.channels_lock.read():
+            with self.lock:
+                channel_names = sorted(self.subscriptions.get(client_id, ()))
+                patterns = sorted(self.pattern_subscriptions.get(client_id, ()))
+            subscriptions = [self.channels[name].to_dict() for name in channel_names if name in self.channels]
+            return {"status": "success", "subscriptions": subscriptions, "patterns": patterns}
+
+    def forget_subscriptions(self, channel_name, client_ids):
         with self.lock:
-            subscriptions = []
-            for channel in self.channels.values():
-                if client_id in channel.subscribers:
-                    subscriptions.append(channel.to_dict())
-            return {"status": "success", "subscriptions": subscriptions}
+            for client_id in client_ids:
+                channel_names = self.subscriptions.get(client_id)
+                if channel_names is not None:
+                    channel_names.discard(channel_name)
+                    if not channel_names:
+                        del self.subscriptions[client_id]
+
+    def drop_client(self, client_id):
+        """Remove a disconnected client from every channel it subscribed to, and forget its listener"""
+        with self.channels_lock.read():
+            with self.lock:
+                channel_names = self.subscriptions.pop(client_id, ())
+                patterns = self.pattern_subscriptions.pop(client_id, ())
+                self.client_codecs.pop(client_id, None)
+                self.client_owners.pop(client_id, None)
+                self.client_notification_ports.pop(client_id, None)
+                self.client_addresses.pop(client_id, None)
+                connection = self.notification_connections.pop(client_id, None)
+            for pattern in patterns:
+                self.patterns.remove(pattern, client_id)
+            for name in channel_names:
+                channel = self.channels.get(name)
+                if channel is not None:
+                    channel.unsubscribe(client_id)
+                    self.directory.put(channel)
+        # Outside the server locks: closing must never wait behind a send to a slow listener
+        if connection is not None:
+            connection.close()
+
+    def log(self, record):
+        if self.storage is not None:
+            self.storage.append(record)
+
+    def wait_durable(self):
+        """Block until the mutations this thread logged are on disk; False if they could not be written"""
+        if self.storage is not None:
+            return self.storage.wait(self.storage.take_pending())
+        return True
+
+    def not_persisted(self, response):
+        """The response to a request whose logged change did not reach the disk. The change was applied
+        and subscribers were notified, so it still succeeded; it is only lost if the server restarts."""
+        self.metrics.inc("storage_errors_total")
+        return dict(response, durable=False,
+                    message=f"{response.get('message', 'Done')} (but not saved, it is lost if the server restarts)")
+
+    def snapshot(self):
+        with self.channels_lock.write():
+            state = {"channels": [channel.to_snapshot() for channel in self.channels.values()]}
+            generation = self.storage.rotate()
+        self.storage.write_snapshot(generation, state)
+
+    def recover(self):
+        """Restore channels and news. Subscriptions belong to client connections, which do not survive
+        a restart, so they are not persisted; older snapshots and logs that hold them are ignored. So are
+        owners that were only a connection: their channels come back unowned, see owns()."""
+        state, records = self.storage.recover()
+        if isinstance(state, list):
+            state = {"channels": state}  # Snapshots from before pattern subscriptions
+        state = state or {}
+        for entry in state.get("channels", ()):
+            channel = Channel(entry["name"], entry["description"], entry["creator"], self.news_history, self.news_max_age,
+                              entry.get("coalesce_ms", 0), entry.get("owner"))
+            for seq, content, author, timestamp in entry["news"]:
+                channel.restore_news(seq, content, author, timestamp)
+            channel.next_seq = entry["next_seq"]
+            self.channels[channel.name] = channel
+        for record in records:
+            self.apply(record)
+
+    def apply(self, record):
+        op = record["op"]
+        if op not in ("create_channel", "delete_channel", "publish_news", "adopt_channel"):
+            return  # Subscription records written by older versions
+        channel = self.channels.get(record["channel"])
+        if op == "create_channel":
+            # Records from before owners were logged recover unowned, like those of clients without a token
+            self.channels[record["channel"]] = Channel(record["channel"], record["description"], record["creator"],
+                                                       self.news_history, self.news_max_age,
+                                                       record.get("coalesce_ms", 0), record.get("owner"))
+        elif channel is None:
+            return
+        elif op == "adopt_channel":
+            channel.owner = record["owner"]
+        elif op == "delete_channel":
+            del self.channels[channel.name]
+        elif op == "publish_news":
+            channel.restore_news(record["seq"], record["content"], record["author"], record["timestamp"])
+
+    def enqueue_notification(self, notify, *args):
+        # Fan-out only enqueues onto the delivery scheduler, the workers do the network I/O
+        try:
+            notify(*args)
+        except Exception:
+            self.metrics.inc("notify_errors_total")
 
     def notify_all_clients(self, notification):
         with self.lock:
-            for client_id in self.client_notification_ports:
-                try:
-                    host, port = self.client_addresses[client_id]
-                    self.send_notification(host, port, notification)
-                except Exception:
-                    pass
+            recipients = list(self.notification_connections.values())
+        self.deliver_notification(recipients, notification)
+
+    def notify_new_channel(self, channel, notification):
+        # Clients whose patterns cover the new channel are told they will receive its news
+        followers = self.patterns.match(channel.name)
+        with self.lock:
+            connections = list(self.notification_connections.items())
+        if not followers:
+            self.deliver_notification([connection for _, connection in connections], notification)
+            return
+        self.deliver_notification([connection for client_id, connection in connections if client_id not in followers],
+                                  notification)
+        self.deliver_notification([connection for client_id, connection in connections if client_id in followers],
+                                  dict(notification, followed=True))
 
     def notify_subscribers(self, channel, notification):
+        # A client following the channel both directly and through patterns still gets one copy
+        subscribers = channel.subscriber_snapshot(self.patterns.match(channel.name))
         with self.lock:
-            for client_id in channel.subscribers:
-                try:
-                    if client_id in self.client_notification_ports:
-                        host, port = self.client_addresses[client_id]
-                        self.send_notification(host, port, notification)
-                except Exception:
-                    pass
-
-    def send_notification(self, host, port, notification):
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            message = json.dumps(notification).encode()
-            sock.sendall(len(message).to_bytes(4, 'big'))
-            sock.sendall(message)
-            sock.close()
-        except Exception:
-            pass
+            recipients = [self.notification_connections[client_id] for client_id in subscribers
+                          if client_id in self.notification_connections]
+        self.deliver_notification(recipients, notification)
+
+    def deliver_notification(self, recipients, notification):
+        # One frame per codec in use, shared by every recipient that negotiated it
+        start = time.perf_counter()
+        by_codec = {}
+        for connection in recipients:
+            by_codec.setdefault(connection.codec, []).append(connection)
+        for codec, connections in by_codec.items():
+            self.deliver(connections, encode_frame(notification, codec))
+        self.metrics.observe("fanout_seconds", notification["type"], time.perf_counter() - start)
+
+    def deliver(self, recipients, frame):
+        self.scheduler.submit(recipients, frame)
+
+    def send_notification(self, connection, frame):
+        start = time.perf_counter()
+        ok = connection.send(frame)
+        self.metrics.observe("send_seconds", None, time.perf_counter() - start)
+        if not ok:
+            self.metrics.inc("failed_sends_total")
+            self.forget_notification_connection(connection)
+        return ok
+
+    def forget_notification_connection(self, connection):
+        """Stop notifying a listener that could not be reached, until its client announces it again"""
+        with self.lock:
+            if self.notification_connections.get(connection.client_id) is not connection:
+                return
+            del self.notification_connections[connection.client_id]
+            self.client_notification_ports.pop(connection.client_id, None)
+            self.client_addresses.pop(connection.client_id, None)
+        connection.close()
+        self.metrics.inc("reaped_listeners_total")
+
+    def send_heartbeats(self):
+        # A listener that went away without its client disconnecting fails this send and is reaped
+        self.notify_all_clients({"type": "heartbeat"})
+        self.call_later(self.heartbeat_interval, self.send_heartbeats)
+
+    def start_heartbeats(self):
+        if self.heartbeat_interval:
+            self.call_later(self.heartbeat_interval, self.send_heartbeats)
 
     def receive_exact(self, sock, n):
         data = b''
@@ -194,65 +695,244 @@ class Server:
             data += packet
         return data
 
-    def handle_notification_hello(self, client_id, notification_port, client_addr):
+    def open_notification_connection(self, host, port):
+        return NotificationConnection(host, port)
+
+    def handle_notification_hello(self, client_id, notification_port, client_addr, codec_name=None, token=None):
+        replaced = None
         with self.lock:
+            if token:
+                self.client_owners[client_id] = token_owner(str(token))
+            if codec_name is not None:
+                self.client_codecs[client_id] = self.codecs.get(codec_name, self.codecs["json"])
+            codec = self.client_codecs.get(client_id, self.codecs["json"])
+            address = (client_addr[0], notification_port)
             self.client_notification_ports[client_id] = notification_port
-            self.client_addresses[client_id] = (client_addr[0], notification_port)
+            previous = self.notification_connections.get(client_id)
+            if self.client_addresses.get(client_id) != address or previous is None or previous.closed:
+                replaced = previous
+                self.notification_connections[client_id] = self.open_notification_connection(*address)
+                self.notification_connections[client_id].client_id = client_id
+            self.notification_connections[client_id].codec = codec
+            self.client_addresses[client_id] = address
+        if replaced is not None:
+            replaced.close()
+        return codec
+
+    def dispatch(self, request, client_id, client_addr):
+        req_type = request.get("type")
+        if req_type == "notification_hello":
+            codec = self.handle_notification_hello(client_id, request.get("notification_port", 0), client_addr,
+                                                   request.get("codec", "json"), request.get("token"))
+            # Clients pace their heartbeats by idle_timeout
+            response = {"status": "success", "message": "Notification port registered", "codec": codec.name,
+                        "idle_timeout": self.idle_timeout}
+        elif req_type == "list_channels":
+            response = self.handle_list_channels(request.get("since_version"), request.get("cursor"),
+                                                 request.get("limit"), request.get("prefix"), request.get("search"))
+        elif req_type == "create_channel":
+            response = self.handle_create_channel(request["channel_name"], request["description"], client_id,
+                                                  request.get("coalesce_ms"))
+            if response["status"] == "success":
+                self.handle_notification_hello(client_id, request.get("notification_port", 0), client_addr)
+        elif req_type == "delete_channel":
+            response = self.handle_delete_channel(request["channel_name"], client_id)
+        elif req_type == "subscribe":
+            response = self.handle_subscribe(request["channel_name"], client_id)
+        elif req_type == "unsubscribe":
+            response = self.handle_unsubscribe(request["channel_name"], client_id)
+        elif req_type == "publish_news":
+            response = self.handle_publish_news(request["channel_name"], request["content"], client_id)
+        elif req_type == "publish_batch":
+            response = self.handle_publish_batch(request["channel_name"], request["contents"], client_id)
+        elif req_type == "get_subscriptions":
+            response = self.handle_get_subscriptions(client_id)
+        elif req_type == "get_news":
+            response = self.handle_get_news(request["channel_name"], request.get("cursor", 0), request.get("limit", 50))
+        elif req_type == "stats":
+            response = {"status": "success", "stats": self.stats()}
+        elif req_type == "heartbeat":
+            # Clients send these while idle so the connection outlives idle_timeout
+            response = {"status": "success"}
+        elif req_type == "client_disconnected" and self.trusted_proxy:
+            self.drop_client(client_id)
+            response = {"status": "success", "message": "Client dropped"}
+        else:
+            response = {"status": "error", "message": "Unknown request type"}
+        return response
+
+    def handle_request(self, data, client_id, client_addr):
+        start = time.perf_counter()
+        request = None
+        req_type = "invalid"
+        try:
+            # A compressed body may not expand past the limit its frame was held to
+            request = decode(data, self.max_frame_bytes)
+            req_type = request.get("type")
+            if self.trusted_proxy and "client_id" in request:
+                # Behind a shard router every client shares the router's connection
+                client_id = request["client_id"]
+                client_addr = (request["client_host"], 0)
+            response = self.dispatch(request, client_id, client_addr)
+        except FrameTooLarge:
+            response = dict(FRAME_TOO_LARGE)
+        except Exception:
+            response = {"status": "error", "message": "Invalid request format"}
+        # Pipelining clients match responses to their requests by this optional id
+        if isinstance(request, dict) and "request_id" in request:
+            response["request_id"] = request["request_id"]
+        # Clients choose the type string, so anything unexpected shares one label
+        label = req_type if req_type in self.REQUEST_TYPES or req_type == "invalid" else "unknown"
+        self.metrics.observe("request_seconds", label, time.perf_counter() - start)
+        if response["status"] != "success":
+            self.metrics.inc("request_errors_total", label)
+        return response
+
+    def gauges(self):
+        opened = self.metrics.counter("connections_opened_total")
+        closed = self.metrics.counter("connections_closed_total")
+        with self.lock:
+            notification_connections = len(self.notification_connections)
+        gauges = {
+            "threads": threading.active_count(),
+            "connections": opened - closed,
+            "notification_connections": notification_connections,
+            "channels": len(self.channels)
+        }
+        for key, value in self.delivery_stats().items():
+            if key != "overflow":
+                gauges[f"delivery_{key}"] = value
+        return gauges
+
+    def delivery_stats(self):
+        return self.scheduler.stats()
+
+    def stats(self):
+        return self.metrics.snapshot(self.gauges())
+
+    def start_metrics_listener(self):
+        if self.metrics_port:
+            serve_metrics(lambda: self.metrics.render(self.gauges()), self.host, self.metrics_port)
+            print(f"Metrics on http://{self.host}:{self.metrics_port}/")
 
     def handle_client(self, client_socket, client_addr):
         client_id = f"{client_addr[0]}:{client_addr[1]}"
+        self.metrics.inc("connections_opened_total")
         try:
             while True:
+                client_socket.settimeout(self.idle_timeout)
                 length_bytes = self.receive_exact(client_socket, 4)
                 if not length_bytes:
                     break
                 msg_len = int.from_bytes(length_bytes, 'big')
+                if msg_len > self.max_frame_bytes:
+                    self.metrics.inc("oversized_frames_total")
+                    client_socket.sendall(encode_frame(FRAME_TOO_LARGE, self.codecs["json"]))
+                    break
+                # Once a frame has started the rest of it, and the response, get read_timeout
+                client_socket.settimeout(self.read_timeout)
                 data = self.receive_exact(client_socket, msg_len)
                 if not data:
                     break
-                try:
-                    request = json.loads(data.decode())
-                    req_type = request.get("type")
-                    if req_type == "notification_hello":
-                        self.handle_notification_hello(client_id, request.get("notification_port", 0), client_addr)
-                        response = {"status": "success", "message": "Notification port registered"}
-                    elif req_type == "list_channels":
-                        response = self.handle_list_channels()
-                    elif req_type == "create_channel":
-                        response = self.handle_create_channel(request["channel_name"], request["description"], client_id)
-                        if response["status"] == "success":
-                            self.client_notification_ports[client_id] = request.get("notification_port", 0)
-                            self.client_addresses[client_id] = (client_addr[0], request.get("notification_port", 0))
-                    elif req_type == "delete_channel":
-                        response = self.handle_delete_channel(request["channel_name"], client_id)
-                    elif req_type == "subscribe":
-                        response = self.handle_subscribe(request["channel_name"], client_id)
-                    elif req_type == "unsubscribe":
-                        response = self.handle_unsubscribe(request["channel_name"], client_id)
-                    elif req_type == "publish_news":
-                        response = self.handle_publish_news(request["channel_name"], request["content"], client_id)
-                    elif req_type == "get_subscriptions":
-                        response = self.handle_get_subscriptions(client_id)
-                    else:
-                        response = {"status": "error", "message": "Unknown request type"}
-                    resp_bytes = json.dumps(response).encode()
-                    client_socket.sendall(len(resp_bytes).to_bytes(4, 'big'))
-                    client_socket.sendall(resp_bytes)
-                except Exception:
-                    error = {"status": "error", "message": "Invalid request format"}
-                    err_bytes = json.dumps(error).encode()
-                    client_socket.sendall(len(err_bytes).to_bytes(4, 'big'))
-                    client_socket.sendall(err_bytes)
+                # Requests in either codec are accepted; responses use the one negotiated before this request
+                codec = self.client_codecs.get(client_id, self.codecs["json"])
+                response = self.handle_request(data, client_id, client_addr)
+                if not self.wait_durable():
+                    response = self.not_persisted(response)
+                client_socket.sendall(encode_frame(response, codec))
+        except socket.timeout:
+            self.metrics.inc("timed_out_connections_total")
+        except OSError:
+            pass
         finally:
+            self.drop_client(client_id)
             client_socket.close()
+            self.peers.release(client_addr[0])
+            self.metrics.inc("connections_closed_total")
+
+    def reject(self, client_socket):
+        self.metrics.inc("rejected_connections_total")
+        try:
+            client_socket.settimeout(self.read_timeout)
+            client_socket.sendall(encode_frame(TOO_MANY_CONNECTIONS, self.codecs["json"]))
+        except OSError:
+            pass
+        client_socket.close()
 
     def run(self):
-        self.sock.listen(5)
-        print(f"Server running on {HOST}:{PORT} (TCP)")
+        self.scheduler.start()
+        if self.storage is not None:
+            self.storage.start(self.snapshot)
+        self.start_metrics_listener()
+        self.start_heartbeats()
+        self.sock.listen(self.backlog)
+        print(f"Server running on {self.host}:{self.port} (TCP)")
         while True:
             client_socket, client_addr = self.sock.accept()
+            if not self.peers.acquire(client_addr[0]):
+                self.reject(client_socket)
+                continue
             threading.Thread(target=self.handle_client, args=(client_socket, client_addr), daemon=True).start()
 
+def build_server(args, port=None, data_dir=None, trusted_proxy=False, metrics_port=None, host=None):
+    data_dir = data_dir or args.data_dir
+    storage = None
+    if data_dir:
+        storage = Storage(data_dir, fsync=not args.no_fsync, snapshot_every=args.snapshot_every)
+    options = dict(
+        delivery_workers=args.delivery_workers, queue_size=args.queue_size, overflow=args.overflow,
+        news_history=args.news_history, news_max_age=args.news_max_age, storage=storage,
+        forbidden_words_file=args.forbidden_words, whole_word=args.whole_word,
+        compress_threshold=args.compress_threshold, trusted_proxy=trusted_proxy,
+        metrics_port=metrics_port or args.metrics_port, coalesce_ms=args.coalesce_ms, backlog=args.backlog,
+        idle_timeout=args.idle_timeout or None, read_timeout=args.read_timeout or None,
+        heartbeat_interval=args.heartbeat_interval, max_frame_bytes=args.max_frame_bytes,
+        max_connections_per_peer=args.max_connections_per_peer
+    )
+    if args.engine == "asyncio":
+        from async_server import AsyncServer
+        return AsyncServer(host or args.host, port or args.port, **options)
+    return Server(host or args.host, port or args.port, **options)
+
 if __name__ == "__main__":
-    server = Server()
-    server.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="News channel server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--delivery-workers", type=int, default=8)
+    parser.add_argument("--queue-size", type=int, default=1024, help="Max queued notifications per subscriber")
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default="drop_oldest")
+    parser.add_argument("--news-history", type=int, default=1000, help="News kept per channel")
+    parser.add_argument("--news-max-age", type=int, default=None, help="Seconds a news item is kept")
+    parser.add_argument("--data-dir", default=None, help="Persist state to a write-ahead log in this directory")
+    parser.add_argument("--no-fsync", action="store_true", help="Write the log without fsync")
+    parser.add_argument("--snapshot-every", type=int, default=50000, help="Logged mutations between snapshots")
+    parser.add_argument("--coalesce-ms", type=int, default=0,
+                        help="Default window for merging a channel's notifications into one news_batch frame")
+    parser.add_argument("--forbidden-words", default=None, help="File with one forbidden term per line, reloaded on change")
+    parser.add_argument("--whole-word", action="store_true", help="Only block forbidden terms that appear as whole words")
+    parser.add_argument("--compress-threshold", type=int, default=1024,
+                        help="Compress binary-codec frames larger than this many bytes")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve plaintext metrics over HTTP on this port")
+    parser.add_argument("--backlog", type=int, default=1024, help="Pending connections the listener queues")
+    parser.add_argument("--idle-timeout", type=float, default=120,
+                        help="Close connections that send no request for this many seconds (0 disables)")
+    parser.add_argument("--read-timeout", type=float, default=10,
+                        help="Close connections that stall this many seconds inside a frame (0 disables)")
+    parser.add_argument("--heartbeat-interval", type=float, default=30,
+                        help="Seconds between heartbeats on notification connections (0 disables)")
+    parser.add_argument("--max-frame-bytes", type=int, default=1 << 20, help="Largest request accepted")
+    parser.add_argument("--max-connections-per-peer", type=int, default=None,
+                        help="Refuse connections beyond this many from one address")
+    parser.add_argument("--shards", type=int, default=1, help="Partition channels across this many worker processes")
+    parser.add_argument("--shard-base-port", type=int, default=None,
+                        help="First internal port for shard workers, bound to 127.0.0.1 (default: --port + 1)")
+    parser.add_argument("--shard-links", type=int, default=8,
+                        help="Router connections to each shard; a shard serves one request per connection at a time")
+    args = parser.parse_args()
+    if args.shards > 1:
+        from sharded import ShardRouter
+        ShardRouter(args).run()
+    else:
+        build_server(args).run()
@@ -0,0 +1,311 @@
+import asyncio
+import heapq
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from itertools import count, islice
+
+from async_server import IdleReaper
+from codec import FrameTooLarge, decode, encode_frame, make_codecs
+from server import FRAME_TOO_LARGE, TOO_MANY_CONNECTIONS, PeerLimiter, Server, build_server
+from topics import is_pattern
+
+# Shards trust the client identity in each request, so only the router, on this machine, may reach them
+SHARD_HOST = "127.0.0.1"
+
+SHARD_UNAVAILABLE = {"status": "error", "message": "Shard unavailable"}
+
+# Requests answered by merging the responses of every shard: request type -> list key to concatenate
+AGGREGATED = {"get_subscriptions": "subscriptions"}
+
+def shard_for(channel_name, shards):
+    # crc32 instead of hash(): it must agree across processes and restarts
+    return zlib.crc32(channel_name.encode()) % shards
+
+def run_shard(args, port, data_dir, metrics_port):
+    parent = os.getppid()
+
+    def exit_with_router():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=exit_with_router, daemon=True).start()
+    build_server(args, port=port, data_dir=data_dir, trusted_proxy=True, metrics_port=metrics_port,
+                 host=SHARD_HOST).run()
+
+class ShardLink:
+    """One pipelined connection from the router to a shard, multiplexing many clients by request_id"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.codec = make_codecs()["json"]
+        self.writer = None
+        self.pending = {}  # request_id -> Future
+        self.request_ids = count(1)
+        self.connected = None
+
+    async def connect(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        asyncio.get_running_loop().create_task(self.read_responses(reader))
+
+    async def request(self, request):
+        if self.writer is None or self.writer.is_closing():
+            # Concurrent callers share a single connection attempt
+            if self.connected is None or self.connected.done():
+                self.connected = asyncio.ensure_future(self.connect())
+            try:
+                await asyncio.shield(self.connected)
+            except OSError:
+                # A shard that is down fails its own requests, the next one tries to connect again
+                return dict(SHARD_UNAVAILABLE)
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(encode_frame(dict(request, request_id=request_id), self.codec))
+        return await future
+
+    async def read_responses(self, reader):
+        try:
+            while True:
+                length_bytes = await reader.readexactly(4)
+                response = decode(await reader.readexactly(int.from_bytes(length_bytes, 'big')))
+                future = self.pending.pop(response.pop("request_id", None), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_result(dict(SHARD_UNAVAILABLE))
+            self.pending.clear()
+
+class ShardRouter:
+    """Front listener that owns no channels: it routes each request to the shard owning the channel.
+
+    Shards are ordinary Server processes on internal ports started with
+    trusted_proxy, so they attribute each forwarded request to the real
+    client and deliver notifications straight to the client's listener.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.host = args.host
+        self.port = args.port
+        self.shards = args.shards
+        base_port = args.shard_base_port or args.port + 1
+        self.shard_ports = [base_port + i for i in range(self.shards)]
+        self.codecs = make_codecs(args.compress_threshold)
+        # Several links per shard, since a shard answers the requests of one link one at a time
+        self.links = [[ShardLink(SHARD_HOST, port) for _ in range(max(1, args.shard_links))]
+                      for port in self.shard_ports]
+        # Client connections end here, so the router enforces the connection limits; shards run without them
+        self.peers = PeerLimiter(args.max_connections_per_peer)
+        self.reaper = IdleReaper()
+        self.processes = []
+        self.stopping = False
+
+    def start_shards(self):
+        for i, port in enumerate(self.shard_ports):
+            data_dir = os.path.join(self.args.data_dir, f"shard-{i}") if self.args.data_dir else None
+            # Each shard serves its own metrics, on consecutive ports from --metrics-port
+            metrics_port = self.args.metrics_port + i if self.args.metrics_port else None
+            process = multiprocessing.Process(target=run_shard, args=(self.args, port, data_dir, metrics_port),
+                                              name=f"shard-{i}", daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    async def wait_for_shards(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        for port in self.shard_ports:
+            while True:
+                try:
+                    _, writer = await asyncio.open_connection(SHARD_HOST, port)
+                    writer.close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    await asyncio.sleep(0.05)
+
+    async def route(self, request, client_id, client_host):
+        try:
+            return await self.route_request(request, client_id, client_host)
+        except Exception:
+            # Malformed fields surface here; the single-process server answers them the same way
+            return {"status": "error", "message": "Invalid request format"}
+
+    def links_for(self, client_id):
+        """The link to each shard that carries this client's requests. A client always gets the same
+        ones, so every shard handles its requests in the order they were sent."""
+        i = zlib.crc32(client_id.encode()) % len(self.links[0])
+        return [links[i] for links in self.links]
+
+    async def route_request(self, request, client_id, client_host):
+        forwarded = dict(request, client_id=client_id, client_host=client_host)
+        forwarded.pop("request_id", None)
+        req_type = request.get("type")
+        if req_type == "heartbeat":
+            return {"status": "success"}
+        links = self.links_for(client_id)
+        if req_type == "list_channels":
+            return await self.route_list_channels(links, forwarded)
+        pattern = req_type in ("subscribe", "unsubscribe") and is_pattern(request.get("channel_name", ""))
+        if req_type in AGGREGATED or req_type in ("notification_hello", "stats") or pattern:
+            # Every shard must know where to push this client's notifications, and which patterns it follows
+            responses = await asyncio.gather(*(link.request(forwarded) for link in links))
+            failed = [response for response in responses if response.get("status") != "success"]
+            if failed:
+                return failed[0]
+            if req_type == "notification_hello":
+                # Shards run without idle timeouts, the router's is the one clients must beat
+                return dict(responses[0], idle_timeout=self.args.idle_timeout or None)
+            if pattern:
+                return responses[0]
+            if req_type == "stats":
+                return {"status": "success", "stats": {"shards": [response["stats"] for response in responses]}}
+            key = AGGREGATED[req_type]
+            merged = [item for response in responses for item in response[key]]
+            # Pattern subscriptions are registered on every shard, so any shard's list is complete
+            return {"status": "success", key: merged, "patterns": responses[0].get("patterns", [])}
+        if "channel_name" in request:
+            return await links[shard_for(request["channel_name"], self.shards)].request(forwarded)
+        return await links[0].request(forwarded)
+
+    async def route_list_channels(self, links, forwarded):
+        """Merge the shards' directories; the version is every shard's version joined by '|'"""
+        versions = str(forwarded.pop("since_version", "") or "").split("|")
+        if len(versions) == len(links):
+            responses = await asyncio.gather(*(link.request(dict(forwarded, since_version=version))
+                                               for link, version in zip(links, versions)))
+            if all(response.get("status") == "success" and not response["full"] for response in responses):
+                return {"status": "success", "version": "|".join(response["version"] for response in responses),
+                        "full": False,
+                        "channels": list(heapq.merge(*(response["channels"] for response in responses),
+                                                     key=lambda channel: channel["name"])),
+                        "deleted": sorted(name for response in responses for name in response["deleted"])}
+        responses = await asyncio.gather(*(link.request(forwarded) for link in links))
+        failed = [response for response in responses if response.get("status") != "success"]
+        if failed:
+            return failed[0]
+        # Each shard sent its first page after the cursor, so the first page of the merge is exact
+        merged = heapq.merge(*(response["channels"] for response in responses), key=lambda channel: channel["name"])
+        limit = forwarded.get("limit")
+        if limit:
+            limit = max(1, min(int(limit), Server.MAX_CHANNEL_PAGE))
+            channels = list(islice(merged, limit + 1))
+            has_more = len(channels) > limit or any(response["has_more"] for response in responses)
+            channels = channels[:limit]
+        else:
+            channels = list(merged)
+            has_more = False
+        return {"status": "success", "version": "|".join(response["version"] for response in responses), "full": True,
+                "channels": channels, "next_cursor": channels[-1]["name"] if channels else forwarded.get("cursor"),
+                "has_more": has_more}
+
+    async def respond(self, writer, responses):
+        # Responses leave in request order even when shards answer out of order
+        while True:
+            item = await responses.get()
+            if item is None:
+                return
+            task, codec, request_id = item
+            try:
+                response = await task
+            except Exception:
+                # route() answers errors itself, this only keeps the connection answering if that ever slips
+                response = {"status": "error", "message": "Invalid request format"}
+            if request_id is not None:
+                response["request_id"] = request_id
+            writer.write(encode_frame(response, codec))
+            await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        client_addr = writer.get_extra_info("peername")[:2]
+        client_id = f"{client_addr[0]}:{client_addr[1]}"
+        codec = self.codecs["json"]
+        if not self.peers.acquire(client_addr[0]):
+            writer.write(encode_frame(TOO_MANY_CONNECTIONS, codec))
+            writer.close()
+            return
+        idle_timeout = self.args.idle_timeout or None
+        read_timeout = self.args.read_timeout or None
+        responses = asyncio.Queue()
+        responder = asyncio.get_running_loop().create_task(self.respond(writer, responses))
+        try:
+            while True:
+                try:
+                    self.reaper.expect(writer, idle_timeout)
+                    length_bytes = await reader.readexactly(4)
+                    length = int.from_bytes(length_bytes, 'big')
+                    if length > self.args.max_frame_bytes:
+                        task = asyncio.get_running_loop().create_future()
+                        task.set_result(dict(FRAME_TOO_LARGE))
+                        await responses.put((task, codec, None))
+                        break
+                    self.reaper.expect(writer, read_timeout)
+                    data = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                request = None
+                try:
+                    request = decode(data, self.args.max_frame_bytes)
+                    request_id = request.get("request_id")
+                    task = asyncio.ensure_future(self.route(request, client_id, client_addr[0]))
+                except Exception as e:
+                    request_id = None
+                    task = asyncio.get_running_loop().create_future()
+                    task.set_result(dict(FRAME_TOO_LARGE) if isinstance(e, FrameTooLarge)
+                                    else {"status": "error", "message": "Invalid request format"})
+                await responses.put((task, codec, request_id))
+                if isinstance(request, dict) and request.get("type") == "notification_hello":
+                    codec = self.codecs.get(request.get("codec", "json"), self.codecs["json"])
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            # Cancellation only happens at shutdown; ending quietly avoids a noisy traceback
+            pass
+        finally:
+            self.reaper.forget(writer)
+            self.peers.release(client_addr[0])
+            responses.put_nowait(None)
+            try:
+                await responder
+            except (ConnectionError, OSError, asyncio.CancelledError):
+                pass
+            writer.close()
+            # Over the client's own links, so each shard drops it only after handling its last requests
+            for link in self.links_for(client_id) if not self.stopping else ():
+                asyncio.ensure_future(link.request({"type": "client_disconnected", "client_id": client_id,
+                                                    "client_host": client_addr[0]}))
+
+    async def serve(self):
+        await self.wait_for_shards()
+        self.reaper.start(asyncio.get_running_loop())
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=self.args.backlog,
+                                            reuse_address=True)
+        print(f"Server running on {self.host}:{self.port} (TCP, {self.shards} shards on ports "
+              f"{self.shard_ports[0]}-{self.shard_ports[-1]})")
+        def stop():
+            self.stopping = True
+            server.close()
+        # Stop serving on SIGTERM so run() gets to stop the shard processes
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop)
+        async with server:
+            try:
+                await server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def run(self):
+        self.start_shards()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            for process in self.processes:
+                process.terminate()
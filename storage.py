@@ -0,0 +1,205 @@
+import glob
+import json
+import mmap
+import os
+import threading
+import time
+from collections import deque
+
+class Storage:
+    """Append-only write-ahead log with group commit, plus periodic snapshots.
+
+    Records are length-prefixed JSON frames, like the wire protocol. Each
+    snapshot names the log generation that follows it, so recovery loads the
+    snapshot and replays only the logs from that generation on.
+    """
+
+    def __init__(self, directory, fsync=True, group_commit_ms=0, snapshot_every=50000, snapshot_interval=300):
+        self.directory = directory
+        self.fsync = fsync
+        self.group_commit_delay = group_commit_ms / 1000
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(directory, exist_ok=True)
+        self.cond = threading.Condition()
+        self.io_lock = threading.Lock()  # Serializes log writes with log rotation
+        self.local = threading.local()
+        self.buffer = []
+        self.appended = 0
+        self.durable = 0
+        self.failures = deque(maxlen=1024)  # (first, last) commits of recent batches that could not be written
+        self.since_snapshot = 0
+        generations = self.log_generations()
+        self.generation = generations[-1] if generations else self.snapshot_generation()
+        self.file = open(self.log_path(self.generation), "ab")
+
+    def snapshot_path(self):
+        return os.path.join(self.directory, "snapshot.json")
+
+    def log_path(self, generation):
+        return os.path.join(self.directory, f"wal-{generation:08d}.log")
+
+    def log_generations(self):
+        paths = glob.glob(os.path.join(self.directory, "wal-*.log"))
+        return sorted(int(os.path.basename(path)[4:12]) for path in paths)
+
+    def snapshot_generation(self):
+        snapshot = self.read_snapshot()
+        return snapshot["wal"] if snapshot else 0
+
+    def start(self, snapshot):
+        """Start the group-commit flusher and the thread calling snapshot() periodically"""
+        threading.Thread(target=self.flush_loop, name="wal-flush", daemon=True).start()
+        threading.Thread(target=self.snapshot_loop, args=(snapshot,), name="wal-snapshot", daemon=True).start()
+
+    def append(self, record):
+        body = json.dumps(record, separators=(",", ":")).encode()
+        with self.cond:
+            self.buffer.append(len(body).to_bytes(4, 'big') + body)
+            self.appended += 1
+            self.since_snapshot += 1
+            commit = self.appended
+            self.cond.notify_all()
+        self.local.pending = commit
+        return commit
+
+    def take_pending(self):
+        """Commit number of the last record appended by this thread, cleared once taken"""
+        commit = getattr(self.local, "pending", 0)
+        self.local.pending = 0
+        return commit
+
+    def wait(self, commit):
+        """Block until commit was flushed; False if its batch could not be written"""
+        with self.cond:
+            while self.durable < commit:
+                self.cond.wait()
+            return not any(first <= commit <= last for first, last in self.failures)
+
+    def flush_loop(self):
+        while True:
+            with self.cond:
+                while not self.buffer:
+                    self.cond.wait()
+            # Records appended while the previous batch was being fsynced form the next batch;
+            # an optional delay lets even more concurrent writers share one fsync
+            if self.group_commit_delay:
+                time.sleep(self.group_commit_delay)
+            with self.io_lock:
+                self.flush()
+
+    def flush(self):
+        with self.cond:
+            batch, self.buffer = self.buffer, []
+            commit = self.appended
+        failed = False
+        if batch:
+            position = None
+            try:
+                position = self.file.tell()
+                self.file.write(b"".join(batch))
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            except Exception:
+                # e.g. ENOSPC: the batch's writers get an error, later batches try again
+                failed = True
+                self.discard(position)
+        with self.cond:
+            if failed:
+                self.failures.append((commit - len(batch) + 1, commit))
+            self.durable = max(self.durable, commit)
+            self.cond.notify_all()
+
+    def discard(self, position):
+        """Reopen the log without the partly written batch, so it stays a clean run of records"""
+        path = self.log_path(self.generation)
+        try:
+            self.file.close()
+        except Exception:
+            pass
+        try:
+            if position is not None:
+                os.truncate(path, position)
+            self.file = open(path, "ab")
+        except OSError:
+            pass
+
+    def rotate(self):
+        """Close the current log and start the next generation; returns the new generation"""
+        with self.io_lock:
+            self.flush()
+            self.file.close()
+            self.generation += 1
+            self.file = open(self.log_path(self.generation), "ab")
+            with self.cond:
+                self.since_snapshot = 0
+        return self.generation
+
+    def write_snapshot(self, generation, state):
+        path = self.snapshot_path()
+        with open(path + ".tmp", "wb") as f:
+            f.write(json.dumps({"wal": generation, "state": state}, separators=(",", ":")).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        for old in self.log_generations():
+            if old < generation:
+                os.remove(self.log_path(old))
+
+    def snapshot_loop(self, snapshot):
+        last = time.monotonic()
+        while True:
+            time.sleep(0.5)
+            with self.cond:
+                due = self.since_snapshot >= self.snapshot_every or (
+                    self.since_snapshot and time.monotonic() - last >= self.snapshot_interval)
+            if due:
+                try:
+                    snapshot()
+                except Exception:
+                    pass
+                last = time.monotonic()
+
+    def read_snapshot(self):
+        path = self.snapshot_path()
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return None
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return json.loads(data[:])
+
+    def recover(self):
+        """Return (snapshot state or None, iterator over logged records), memory-mapping every file"""
+        snapshot = self.read_snapshot()
+        first = snapshot["wal"] if snapshot else 0
+        generations = [generation for generation in self.log_generations() if generation >= first]
+        return (snapshot["state"] if snapshot else None), self.replay(generations)
+
+    def replay(self, generations):
+        for generation in generations:
+            path = self.log_path(generation)
+            size = os.path.getsize(path)
+            if not size:
+                continue
+            with open(path, "r+b") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    offset = 0
+                    while offset + 4 <= size:
+                        length = int.from_bytes(data[offset:offset + 4], 'big')
+                        if offset + 4 + length > size:
+                            break
+                        yield json.loads(data[offset + 4:offset + 4 + length])
+                        offset += 4 + length
+                if offset < size:
+                    # A torn record from a crash mid-write; drop it so new appends stay aligned
+                    f.truncate(offset)
+
+    def close(self):
+        with self.io_lock:
+            self.flush()
+            self.file.close()
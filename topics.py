@@ -0,0 +1,79 @@
+import threading
+
+SEPARATOR = "/"
+ONE_LEVEL = "*"  # Matches exactly one name segment
+MULTI_LEVEL = "#"  # Matches any number of trailing segments, including none
+
+def is_pattern(name):
+    return any(segment in (ONE_LEVEL, MULTI_LEVEL) for segment in name.split(SEPARATOR))
+
+def valid_pattern(pattern):
+    segments = pattern.split(SEPARATOR)
+    return MULTI_LEVEL not in segments[:-1]
+
+class Node:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children = {}  # segment -> Node; '*' and '#' are ordinary keys here
+        self.subscribers = set()  # client_ids whose pattern ends at this node
+
+class TopicTrie:
+    """Pattern subscriptions indexed by name segment.
+
+    Matching a channel name walks only the branches that can match it, so
+    the cost follows the name's depth and the number of matching
+    subscribers, not the number of patterns registered.
+    """
+
+    def __init__(self):
+        self.root = Node()
+        self.lock = threading.Lock()
+
+    def add(self, pattern, client_id):
+        with self.lock:
+            node = self.root
+            for segment in pattern.split(SEPARATOR):
+                node = node.children.setdefault(segment, Node())
+            node.subscribers.add(client_id)
+
+    def remove(self, pattern, client_id):
+        segments = pattern.split(SEPARATOR)
+        with self.lock:
+            path = [self.root]
+            for segment in segments:
+                node = path[-1].children.get(segment)
+                if node is None:
+                    return
+                path.append(node)
+            path[-1].subscribers.discard(client_id)
+            # Prune the branches left without subscribers
+            for depth in range(len(segments), 0, -1):
+                if path[depth].subscribers or path[depth].children:
+                    break
+                del path[depth - 1].children[segments[depth - 1]]
+
+    def match(self, name):
+        """client_ids with a pattern matching the channel name"""
+        matched = set()
+        with self.lock:
+            nodes = [self.root]
+            for segment in name.split(SEPARATOR):
+                next_nodes = []
+                for node in nodes:
+                    rest = node.children.get(MULTI_LEVEL)
+                    if rest is not None:
+                        matched |= rest.subscribers
+                    for key in (segment, ONE_LEVEL):
+                        child = node.children.get(key)
+                        if child is not None:
+                            next_nodes.append(child)
+                if not next_nodes:
+                    return matched
+                nodes = next_nodes
+            for node in nodes:
+                matched |= node.subscribers
+                rest = node.children.get(MULTI_LEVEL)
+                if rest is not None:
+                    matched |= rest.subscribers
+        return matched